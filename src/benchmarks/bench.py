@@ -0,0 +1,149 @@
+import subprocess
+import tempfile
+import argparse
+import shapely
+import time
+import json
+import os
+
+import fixtures
+import schedule
+import network
+import spatial
+
+
+# Results from every run, one JSON line per scale and stage
+results_path = "../../data/benchmarks/results.jsonl"
+
+# Same walk radius as transform.coverage
+radius = 500 / 1000 / fixtures.walk_speed * 60  # minutes
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    return f"{commit}-dirty" if dirty else commit
+
+
+def best_of(repeat, func, *args, **kwargs):
+
+    # Fastest of several runs, plus the last result for the next stage
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def run_scale(name, repeat=3, workers=1):
+
+    scale = fixtures.scales[name]
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        # Schedule: parse and index, then stop x hour arrivals
+        path = fixtures.write_schedule(
+            os.path.join(directory, "schedule.json"), scale)
+        stops = fixtures.stops_frame(scale)
+
+        timings["schedule_index"], index = best_of(
+            repeat, lambda: schedule.schedule_index(schedule.iter_stop_times(path)))
+        timings["stop_hour_arrivals"], _ = best_of(
+            repeat, schedule.stop_hour_arrivals, index, stops)
+
+    # Walk network: per-stop isochrones and the multi-source walk-shed
+    graph = fixtures.grid_graph(scale)
+    sources = fixtures.stop_sources(scale, graph)
+
+    timings["isochrones"], isochrones = best_of(
+        repeat, network.isochrones, graph, sources, radius=radius, workers=workers)
+    timings["walkshed"], _ = best_of(
+        repeat, network.walkshed, graph, sources, radius=radius)
+
+    # Area weighting of blocks against the coverage polygon
+    blocks = fixtures.blocks(scale)
+    coverage = shapely.union_all(isochrones)
+    timings["area_ratio"], _ = best_of(
+        repeat, spatial.area_ratio, blocks.geometry, coverage)
+
+    return timings
+
+
+def previous_results(path, commit):
+
+    # Latest timing per scale and stage from any other commit
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+
+    with open(path, "r") as file:
+        for line in file:
+            record = json.loads(line)
+            if record["commit"] != commit:
+                previous[(record["scale"], record["stage"])] = record
+
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the pipeline hot spots on synthetic inputs")
+    parser.add_argument("--scales", nargs="+", default=["small", "berkeley"],
+                        choices=sorted(fixtures.scales))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Isochrone worker processes")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown over the previous commit flagged as a regression")
+    parser.add_argument("--output", default=results_path)
+    args = parser.parse_args()
+
+    commit = git_commit()
+    previous = previous_results(args.output, commit)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+
+    regressions = []
+    for name in args.scales:
+        for stage, seconds in run_scale(name, args.repeat, args.workers).items():
+            record = {
+                "commit": commit,
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "scale": name,
+                "stage": stage,
+                "seconds": round(seconds, 4),
+                "repeat": args.repeat
+            }
+            with open(args.output, "a") as file:
+                file.write(json.dumps(record) + "\n")
+
+            # Compare against the last run on another commit
+            baseline = previous.get((name, stage))
+            change = ""
+            if baseline is not None:
+                ratio = seconds / baseline["seconds"] if baseline["seconds"] else 1
+                change = f"{ratio - 1:+.0%} vs {baseline['commit']}"
+                if ratio > 1 + args.threshold:
+                    regressions.append(f"{name}/{stage} {change}")
+                    change += "  REGRESSION"
+
+            print(f"{name:10} {stage:20} {seconds:9.4f}s  {change}")
+
+    if regressions:
+        raise SystemExit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
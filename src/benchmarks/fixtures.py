@@ -0,0 +1,152 @@
+from typing import NamedTuple
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pipeline"))
+
+import network  # noqa: E402
+
+
+# Sizes of one synthetic fixture set
+class Scale(NamedTuple):
+    routes: int
+    trips_per_route: int
+    stops_per_route: int
+    stops: int
+    grid: int  # walk graph is grid x grid nodes
+    blocks: int  # block polygons are blocks x blocks squares
+
+
+scales = {
+    "small": Scale(routes=5, trips_per_route=10, stops_per_route=15,
+                   stops=60, grid=40, blocks=10),
+    "berkeley": Scale(routes=30, trips_per_route=60, stops_per_route=40,
+                      stops=1000, grid=120, blocks=35),
+    "county": Scale(routes=150, trips_per_route=80, stops_per_route=60,
+                    stops=5000, grid=400, blocks=120),
+}
+
+# Grid spacing and walking speed of the synthetic walk graph
+spacing = 80  # meters
+walk_speed = 5  # kph
+
+
+def route_stops(scale, seed=0):
+
+    # Stops served by each route, in stop order along the route
+    rng = np.random.default_rng(seed)
+    return [
+        rng.choice(scale.stops, size=scale.stops_per_route, replace=False)
+        for _ in range(scale.routes)
+    ]
+
+
+def write_schedule(path, scale, seed=0):
+
+    # Trips run every few minutes from 5:00, in the AC Transit JSON layout
+    rng = np.random.default_rng(seed + 1)
+    headway = 1140 // scale.trips_per_route
+    routes = []
+    for route, stops in enumerate(route_stops(scale, seed)):
+        trips = []
+        for trip in range(scale.trips_per_route):
+            start = 300 + trip * headway
+            minutes = start + np.cumsum(
+                rng.integers(1, 4, size=len(stops)))
+            minutes = np.minimum(minutes, 24 * 60 - 1)
+            trips.append({
+                "TripId": f"{route}-{trip}",
+                "Direction": "Outbound" if trip % 2 else "Inbound",
+                "StartTime": f"{start // 60:02d}:{start % 60:02d}",
+                "StopTimes": [
+                    {
+                        "StopId": str(stop),
+                        "StopTime": f"2026-01-03T{minute // 60:02d}:{minute % 60:02d}:00"
+                    }
+                    for stop, minute in zip(stops, minutes)
+                ]
+            })
+
+        routes.append({"RouteId": str(route), "Trips": trips})
+
+    with open(path, "w") as file:
+        json.dump(routes, file)
+
+    return path
+
+
+def stops_frame(scale, seed=0):
+
+    # Routes per stop, space-delimited as in the stops layer
+    served = {}
+    for route, stops in enumerate(route_stops(scale, seed)):
+        for stop in stops:
+            served.setdefault(int(stop), []).append(str(route))
+
+    return pd.DataFrame({
+        "stop_id": pd.array([str(stop) for stop in range(scale.stops)], dtype="string"),
+        "routes": pd.array(
+            [" ".join(served.get(stop, [])) for stop in range(scale.stops)],
+            dtype="string"
+        )
+    })
+
+
+def grid_graph(scale):
+
+    # Four-connected street grid, weighted by walking minutes
+    n = scale.grid
+    ids = np.arange(n * n).reshape(n, n)
+    pairs = np.concatenate([
+        np.column_stack([ids[:, :-1].ravel(), ids[:, 1:].ravel()]),
+        np.column_stack([ids[:-1, :].ravel(), ids[1:, :].ravel()])
+    ])
+    sources = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    targets = np.concatenate([pairs[:, 1], pairs[:, 0]])
+
+    order = np.lexsort((targets, sources))
+    sources, targets = sources[order], targets[order]
+    indptr = np.zeros(n * n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n * n), out=indptr[1:])
+
+    x, y = np.meshgrid(np.arange(n) * spacing, np.arange(n) * spacing)
+
+    return network.CSRGraph(
+        nodes=np.arange(n * n),
+        indptr=indptr,
+        indices=targets.astype(np.int32),
+        weights=np.full(len(targets), spacing / 1000 / walk_speed * 60),
+        x=x.ravel().astype(float),
+        y=y.ravel().astype(float),
+        crs="EPSG:3310"
+    )
+
+
+def stop_sources(scale, graph, seed=0):
+
+    # Stops snapped to random graph nodes
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, len(graph.nodes), size=scale.stops)
+
+
+def blocks(scale):
+
+    # Square blocks tiling the same extent as the walk graph
+    extent = (scale.grid - 1) * spacing
+    size = extent / scale.blocks
+    i, j = np.meshgrid(np.arange(scale.blocks), np.arange(scale.blocks))
+    i, j = i.ravel(), j.ravel()
+
+    return gpd.GeoDataFrame(
+        {
+            "tract": (i // 5 * 100 + j // 5).astype(str),
+            "population": np.full(len(i), 40)
+        },
+        geometry=shapely.box(i * size, j * size, (i + 1) * size, (j + 1) * size),
+        crs="EPSG:3310"
+    )
@@ -1,5 +1,9 @@
 import geopandas as gpd
 import pandas as pd
+import profiling
+import regions
+import session
+import runner
 import utils
 
 
@@ -7,12 +11,17 @@ import utils
 na_crs = 4269
 
 
+@runner.task(
+    inputs=[utils.raw_dir("2024_06_tract.zip")],
+    outputs=[utils.clean_path("alameda_tracts")]
+)
 def clean_ca_tracts():
 
     # Load data
     gdf = gpd.read_file(
         utils.raw_dir("2024_06_tract.zip")
     )
+    profiling.count(rows_in=len(gdf))
 
     # Rename columns
     gdf = gdf.rename(columns={
@@ -49,13 +58,18 @@ def clean_ca_tracts():
     assert gdf.crs.to_epsg() == na_crs
 
     # Export cleaned
-    utils.export_clean(gdf, "alameda_tracts.geojson")
+    session.write(gdf, "alameda_tracts")
 
 
-def clean_berkeley_boundary():
+@runner.task(
+    inputs=[utils.raw_dir("{region.boundary_file}")],
+    outputs=[utils.clean_path("{region.name}_boundary")]
+)
+def clean_region_boundary(region=regions.berkeley):
 
     # Load data
-    gdf = gpd.read_file(utils.raw_dir("Land_Boundary_20251109.geojson"))
+    gdf = gpd.read_file(utils.raw_dir(region.boundary_file))
+    profiling.count(rows_in=len(gdf))
 
     # Assert data not empty
     assert not gdf.empty
@@ -73,15 +87,20 @@ def clean_berkeley_boundary():
         gdf = gdf.to_crs(na_crs)
 
     # Export cleaned
-    utils.export_clean(gdf, "berkeley_boundary.geojson")
+    session.write(gdf, f"{region.name}_boundary")
 
 
+@runner.task(
+    inputs=[utils.raw_dir("UniqueStops_Fall25.zip")],
+    outputs=[utils.clean_path("ac_stops")]
+)
 def clean_ac_stops():
 
     # Load data
     gdf = gpd.read_file(
         utils.raw_dir("UniqueStops_Fall25.zip")
     )
+    profiling.count(rows_in=len(gdf))
 
     # Rename columns
     gdf = gdf.rename(columns={
@@ -114,15 +133,52 @@ def clean_ac_stops():
         gdf = gdf.to_crs(na_crs)
 
     # Export cleaned
-    utils.export_clean(gdf, "ac_stops.geojson")
+    session.write(gdf, "ac_stops")
 
 
-def clean_ca_block_population():
+@runner.task(
+    inputs=[utils.raw_dir("tl_2020_06_tabblock20.zip")],
+    outputs=[utils.clean_dir("ca_population_total.csv")]
+)
+def clean_ca_population_total():
 
-    # Load data
+    # Load only the population attribute, skipping geometries
+    df = gpd.read_file(
+        utils.raw_dir("tl_2020_06_tabblock20.zip"),
+        columns=["POP20"],
+        ignore_geometry=True
+    )
+    profiling.count(rows_in=len(df))
+
+    population = int(df["POP20"].astype("int").sum())
+
+    # Assert summed pop equals actual census pop in 2020
+    assert population == 39538223
+
+    # Export statewide aggregate
+    session.write_csv(
+        pd.DataFrame({"population": [population]}),
+        "ca_population_total.csv"
+    )
+
+
+@runner.task(
+    inputs=[utils.raw_dir("tl_2020_06_tabblock20.zip")],
+    outputs=[utils.clean_path("block_population")]
+)
+def clean_ca_block_population(county="001", bbox=None):
+
+    # Filter blocks within the read by county and/or bounding box
+    where = f"COUNTYFP20 = '{county}'" if county is not None else None
+
+    # Load data (the filter field must be read for where to match rows)
     gdf = gpd.read_file(
-        utils.raw_dir("tl_2020_06_tabblock20.zip")
+        utils.raw_dir("tl_2020_06_tabblock20.zip"),
+        columns=["COUNTYFP20", "TRACTCE20", "POP20"],
+        where=where,
+        bbox=bbox
     )
+    profiling.count(rows_in=len(gdf))
 
     # Rename columns
     gdf = gdf.rename(columns={
@@ -133,6 +189,9 @@ def clean_ca_block_population():
     # Select relevant columns
     gdf = gdf[["tract", "population", "geometry"]]
 
+    # Assert data not empty
+    assert not gdf.empty
+
     # Convert datatypes
     gdf["tract"] = gdf["tract"].astype("string")
     gdf["population"] = gdf["population"].astype("int")
@@ -140,9 +199,6 @@ def clean_ca_block_population():
     # Assert no missing population
     assert gdf["population"].isna().sum() == 0
 
-    # Assert summed pop equals actual census pop in 2020
-    assert gdf["population"].sum() == 39538223
-
     # Assert valid geometry
     assert gdf.is_valid.all()
 
@@ -150,16 +206,21 @@ def clean_ca_block_population():
     assert gdf.crs is not None
     assert gdf.crs.to_epsg() == na_crs
 
-    # Export cleaned
-    utils.export_clean(gdf, "ca_block_population.geojson")
+    # Export cleaned, sorted by tract so per-tract reads skip other row groups
+    session.write(gdf.sort_values("tract", kind="stable"), "block_population")
 
 
+@runner.task(
+    inputs=[utils.raw_dir("vehicle_ownership_2026-01-04.csv")],
+    outputs=[utils.clean_dir("vehicle_ownership.csv")]
+)
 def clean_vehicle_ownership():
 
     # Load data
     df = pd.read_csv(
         utils.raw_dir("vehicle_ownership_2026-01-04.csv")
     )
+    profiling.count(rows_in=len(df))
 
     # Rename columns
     df = df.rename(columns={
@@ -175,18 +236,20 @@ def clean_vehicle_ownership():
     df = df[["tract", "households", "zero_vehicle_households"]]
 
     # Export cleaned
-    df.to_csv(
-        utils.clean_dir("vehicle_ownership.csv"),
-        index=False
-    )
+    session.write_csv(df, "vehicle_ownership.csv")
 
 
+@runner.task(
+    inputs=[utils.raw_dir("college_population_2026-01-04.csv")],
+    outputs=[utils.clean_dir("college_population.csv")]
+)
 def clean_college_population():
 
     # Load data
     df = pd.read_csv(
         utils.raw_dir("college_population_2026-01-04.csv")
     )
+    profiling.count(rows_in=len(df))
 
     # Rename columns
     df = df.rename(columns={
@@ -201,18 +264,17 @@ def clean_college_population():
     df = df[["tract", "undergrad_pop", "grad_pop"]]
 
     # Export cleaned
-    df.to_csv(
-        utils.clean_dir("college_population.csv"),
-        index=False
-    )
+    session.write_csv(df, "college_population.csv")
 
 
-def main():
+def main(batch=(regions.berkeley,)):
     # Clean ingested data
     clean_ca_tracts()
-    clean_berkeley_boundary()
+    for region in batch:
+        clean_region_boundary(region)
     clean_ac_stops()
     clean_ca_block_population()
+    clean_ca_population_total()
     clean_vehicle_ownership()
     clean_college_population()
 
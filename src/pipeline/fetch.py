@@ -0,0 +1,231 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit, parse_qsl
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import NamedTuple
+import contextvars
+import requests
+import hashlib
+import threading
+import profiling
+import shutil
+import time
+import utils
+import json
+import os
+
+
+# Query parameters left out of cache keys and fixture names
+secret_params = {"token", "key"}
+
+# Identifies the pipeline to APIs that require it (e.g. Nominatim)
+user_agent = "actransit-equity-pipeline"
+
+
+class Response(NamedTuple):
+    status: int
+    headers: dict
+    chunks: object  # iterator of body bytes
+
+
+class HTTPTransport:
+
+    def __init__(self, retries=5, backoff=0.5, pool_size=8, timeout=30, rewrite=None):
+
+        # Pooled connections with exponential backoff on transient errors
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=["GET"],
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = timeout
+
+        # URL prefixes to redirect, e.g. to a local fixture server
+        self.rewrite = rewrite or {}
+
+    def get(self, url, params=None, headers=None):
+        for prefix, replacement in self.rewrite.items():
+            if url.startswith(prefix):
+                url = replacement + url[len(prefix):]
+
+        response = self.session.get(
+            url,
+            params=params,
+            headers=headers,
+            timeout=self.timeout,
+            stream=True
+        )
+
+        return Response(
+            status=response.status_code,
+            headers=dict(response.headers),
+            chunks=response.iter_content(chunk_size=1 << 16)
+        )
+
+
+class DirectoryTransport:
+
+    # Serve responses from files named by fixture_name()
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, url, params=None, headers=None):
+        path = os.path.join(self.directory, fixture_name(url, params))
+        if not os.path.exists(path):
+            return Response(status=404, headers={}, chunks=iter(()))
+
+        def chunks():
+            with open(path, "rb") as file:
+                yield from iter(lambda: file.read(1 << 16), b"")
+
+        return Response(status=200, headers={}, chunks=chunks())
+
+
+def cache_key(url, params=None):
+
+    # Canonical URL with sorted query and secrets removed
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query) + list((params or {}).items())
+    query = sorted(
+        (key, str(value))
+        for key, value in query
+        if key not in secret_params
+    )
+
+    return f"{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(query)}"
+
+
+def fixture_name(url, params=None):
+    return hashlib.sha256(cache_key(url, params).encode()).hexdigest()
+
+
+# Transport shared by every fetch so connections are pooled
+_transport = None
+
+
+def default_transport():
+    global _transport
+
+    # Offline runs read fixtures from INGEST_FIXTURES instead of the network
+    if _transport is None:
+        fixtures = os.getenv("INGEST_FIXTURES")
+        _transport = DirectoryTransport(
+            fixtures) if fixtures else HTTPTransport()
+
+    return _transport
+
+
+class RateLimiter:
+
+    # Space requests at least 1 / per_second apart across threads
+    def __init__(self, per_second):
+        self.interval = 1 / per_second
+        self.lock = threading.Lock()
+        self.next = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch(url, path, params=None, transport=None, limiter=None, revalidate=True):
+
+    transport = transport or default_transport()
+
+    # Content-addressed store plus one index entry per URL
+    name = fixture_name(url, params)
+    index_path = utils.cache_dir(os.path.join("http", "index", f"{name}.json"))
+    objects_dir = utils.cache_dir(os.path.join("http", "objects"))
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    os.makedirs(objects_dir, exist_ok=True)
+
+    entry = None
+    if os.path.exists(index_path):
+        with open(index_path, "r") as file:
+            entry = json.load(file)
+        if not os.path.exists(os.path.join(objects_dir, entry["sha256"])):
+            entry = None
+
+    # Revalidate a cached response instead of downloading it again
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    # Immutable sources are served from the cache without a request
+    if entry and not revalidate:
+        response = Response(status=304, headers={}, chunks=iter(()))
+    else:
+        if limiter is not None:
+            limiter.wait()
+        response = transport.get(url, params=params, headers=headers)
+
+    if response.status == 304 and entry:
+        digest = entry["sha256"]
+
+    elif response.status == 200:
+
+        # Stream the body to a temporary file while hashing it
+        sha256 = hashlib.sha256()
+        tmp = os.path.join(
+            objects_dir, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as file:
+            for chunk in response.chunks:
+                sha256.update(chunk)
+                file.write(chunk)
+                profiling.count(bytes_read=len(chunk))
+
+        digest = sha256.hexdigest()
+        os.replace(tmp, os.path.join(objects_dir, digest))
+
+        entry = {
+            "url": cache_key(url, params),
+            "sha256": digest,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+        with open(index_path, "w") as file:
+            json.dump(entry, file, indent=2)
+
+    else:
+        raise requests.HTTPError(
+            f"GET {cache_key(url, params)} returned {response.status}")
+
+    # Copy the cached object to its destination, replacing it atomically
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copyfile(os.path.join(objects_dir, digest), tmp)
+    os.replace(tmp, path)
+    profiling.count(bytes_written=profiling.path_size(path))
+
+    return path
+
+
+def run_all(jobs, workers=4):
+
+    # Run independent fetch jobs on a thread pool, re-raising any error
+    # (each job keeps the caller's context, e.g. its profiling stage)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, job)
+            for job in jobs
+        ]
+        return [future.result() for future in futures]
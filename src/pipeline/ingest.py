@@ -1,10 +1,12 @@
+from contextlib import nullcontext
 from dotenv import load_dotenv
 from datetime import date
-from census import Census
-from us import states
 import geopandas as gpd
 import pandas as pd
-import requests
+import functools
+import hashlib
+import regions
+import fetch
 import utils
 import json
 import os
@@ -13,110 +15,224 @@ import os
 today = date.today().isoformat()
 
 
+def _staged(report, name, func, *args):
+
+    # Run one ingest function as its own report stage
+    with report.stage(name) if report is not None else nullcontext():
+        return func(*args)
+
+
 def ingest_berkeley_boundary():
     url = "https://data.cityofberkeley.info/resource/e3zv-nuhf.geojson"
+    path = utils.raw_dir(f"berkeley_boundary_{today}.geojson")
 
-    try:
-        gdf = gpd.read_file(url)
+    fetch.fetch(url, path)
 
-        if gdf.empty:
-            raise ValueError()
+    # Assert data not empty
+    if gpd.read_file(path).empty:
+        raise ValueError(f"Empty Berkeley boundary from {url}")
 
-        gdf.to_file("berkeley_boundary.geojson", driver="GeoJSON")
 
-    except Exception as e:
-        raise e
+# Nominatim allows at most one request per second
+nominatim_limiter = fetch.RateLimiter(1)
 
 
-def ingest_schedule():
+def ingest_region_boundary(region):
 
-    # AC Transit routes in Berkeley from output of transformation / exploration
-    routes = ['FS', '6', '18', '7', '688', '604', 'E', '51B', '67', '36', '52', '802',
-              '27', '605', '800', '12', '88', '72L', 'J', '72', '22', '72M', 'G', 'F', '851', '65']
+    # Regions without a published land boundary use their OSM boundary,
+    # geocoded through fetch so it is cached and served offline like the rest
+    url = "https://nominatim.openstreetmap.org/search"
+    path = utils.raw_dir(region.boundary_file)
 
-    routes_param = ",".join(routes)
-    api_key = os.getenv("AC_TRANSIT_API_KEY")
-    url = f"https://api.actransit.org/transit/route/{routes_param}/schedule?token={api_key}&dayCode=Weekday&hasAllStops=True"
+    fetch.fetch(
+        url,
+        path,
+        params={
+            "q": region.place,
+            "format": "geojson",
+            "polygon_geojson": 1,
+            "limit": 1
+        },
+        limiter=nominatim_limiter
+    )
 
-    response = requests.get(url, timeout=10)
+    # Assert a boundary polygon came back
+    gdf = gpd.read_file(path)
+    if gdf.empty or not gdf.geom_type.isin(["Polygon", "MultiPolygon"]).all():
+        raise ValueError(f"No boundary polygon for {region.place} from {url}")
 
-    assert response.status_code == 200
 
-    raw = response.json()
+def batch_routes(batch):
 
-    with open(utils.raw_dir(f"schedule_{today}.json"), "w") as json_file:
-        json.dump(raw, json_file, indent=4)
+    # Routes serving any AC Transit stop inside the batch's land boundaries
+    stops = gpd.read_file(
+        utils.raw_dir("UniqueStops_Fall25.zip"),
+        columns=["route"]
+    )
+    if stops.crs is None:
+        stops = stops.set_crs(4269)
 
+    boundary = pd.concat([
+        gpd.read_file(utils.raw_dir(region.boundary_file)).to_crs(stops.crs)
+        for region in batch
+    ]).union_all()
+    served = stops.loc[stops.intersects(boundary), "route"].dropna()
 
-def ingest_vehicle_ownership():
-    api_key = os.getenv("CENSUS_API_KEY")
-    c = Census(api_key)
+    routes = sorted({route for routes in served for route in routes.split()})
+    if not routes:
+        raise ValueError(
+            f"No AC Transit routes in {regions.batch_name(batch)}")
 
-    # Berkeley tracts from output of transformation / exploration
-    berkeley_tracts = ['982100', '422902', '422901', '421100', '421400', '421700',
-                       '421800', '421900', '423700', '423800', '423901', '424001',
-                       '422500', '422700', '423000', '423100', '424002', '423300',
-                       '423400', '423500', '423602', '422000', '421200', '422800',
-                       '421300', '423200', '423902', '421500', '421600', '423601',
-                       '422100', '422200', '422300', '422400']
+    return routes
 
-    df = pd.DataFrame(
-        c.acs5.state_county_tract(
-            fields=[
-                "B08201_001E",  # total households
-                "B08201_002E",  # zero-vehicle households
-            ],
-            state_fips="06",
-            county_fips="001",
-            tract=",".join(berkeley_tracts),
-            year=2020
-        )
-    )
 
-    df.to_csv(utils.raw_dir(f"vehicle_ownership_{today}.csv"))
-
-
-def ingest_college_population():
-    api_key = os.getenv("CENSUS_API_KEY")
-    c = Census(api_key)
-
-    # Berkeley tracts from output of transformation / exploration
-    berkeley_tracts = ['982100', '422902', '422901', '421100', '421400', '421700',
-                       '421800', '421900', '423700', '423800', '423901', '424001',
-                       '422500', '422700', '423000', '423100', '424002', '423300',
-                       '423400', '423500', '423602', '422000', '421200', '422800',
-                       '421300', '423200', '423902', '421500', '421600', '423601',
-                       '422100', '422200', '422300', '422400']
-
-    df = pd.DataFrame(
-        c.acs5.state_county_tract(
-            fields=[
-                "B14001_008E",  # population enrolled in college (undergrad)
-                "B14001_009E"  # population enrolled in college (grad)
-            ],
-            state_fips="06",
-            county_fips="001",
-            tract=",".join(berkeley_tracts),
-            year=2020
-        )
-    )
+def ingest_schedule(routes, workers=4):
 
-    df.to_csv(utils.raw_dir(f"college_population_{today}.csv"))
+    # One file per route, so an interrupted run resumes where it stopped
+    output_dir = utils.raw_dir(f"schedule_{today}")
+    os.makedirs(output_dir, exist_ok=True)
 
+    params = {
+        "token": os.getenv("AC_TRANSIT_API_KEY"),
+        "dayCode": "Weekday",
+        "hasAllStops": "True"
+    }
+
+    # Helper: Stream one route's schedule straight to its own file
+    def ingest_route(route, path):
+        return fetch.fetch(
+            f"https://api.actransit.org/transit/route/{route}/schedule",
+            path,
+            params=params
+        )
 
-def main():
+    # Skip routes already on disk
+    jobs = []
+    for route in routes:
+        path = os.path.join(output_dir, f"route_{route}.json")
+        if not os.path.exists(path):
+            jobs.append(functools.partial(ingest_route, route, path))
+
+    # Fetch the remaining routes with a concurrency limit
+    fetch.run_all(jobs, workers=workers)
+
+
+# ACS 5-year variables per raw table
+acs_tables = {
+    "vehicle_ownership": [
+        "B08201_001E",  # total households
+        "B08201_002E",  # zero-vehicle households
+    ],
+    "college_population": [
+        "B14001_008E",  # population enrolled in college (undergrad)
+        "B14001_009E"  # population enrolled in college (grad)
+    ],
+}
+
+# The Census API accepts at most 50 variables per request
+acs_max_variables = 49
+
+
+def ingest_acs(
+    variables,
+    counties=("001",),
+    years=(2020,),
+    state="06",
+    tracts=None,
+    workers=4,
+    requests_per_second=5
+):
+
+    # Shared limiter across all concurrent Census requests
+    limiter = fetch.RateLimiter(requests_per_second)
+    geography = f"tract:{','.join(tracts)}" if tracts else "tract:*"
+
+    # Helper: Fetch all variables for one county and year
+    def fetch_batch(county, year):
+        frames = []
+        for i in range(0, len(variables), acs_max_variables):
+            fields = list(variables[i:i + acs_max_variables])
+            name = hashlib.sha256(
+                f"{year}{state}{county}{geography}{fields}".encode()).hexdigest()[:16]
+
+            # Published ACS vintages don't change, so reuse cached responses
+            path = fetch.fetch(
+                f"https://api.census.gov/data/{year}/acs/acs5",
+                utils.cache_dir(os.path.join("acs", f"{name}.json")),
+                params={
+                    "get": ",".join(fields),
+                    "for": geography,
+                    "in": f"state:{state} county:{county}",
+                    "key": os.getenv("CENSUS_API_KEY")
+                },
+                limiter=limiter,
+                revalidate=False
+            )
+
+            with open(path, "r") as file:
+                header, *rows = json.load(file)
+
+            df = pd.DataFrame(rows, columns=header)
+            df[fields] = df[fields].apply(pd.to_numeric)
+            frames.append(df.set_index(["state", "county", "tract"]))
+
+        # Merge variable chunks on the geography
+        df = pd.concat(frames, axis=1).reset_index()
+        df["year"] = year
+        return df
+
+    jobs = [
+        functools.partial(fetch_batch, county, year)
+        for year in years
+        for county in counties
+    ]
+    frames = fetch.run_all(jobs, workers=workers)
+
+    # Select variables followed by geography, as the census client returned
+    df = pd.concat(frames, ignore_index=True)
+    return df[list(variables) + ["state", "county", "tract", "year"]]
+
+
+def ingest_census_tables():
+
+    # One request for every table's variables, for every Alameda tract
+    variables = [field for fields in acs_tables.values() for field in fields]
+    df = ingest_acs(variables, counties=["001"], years=[2020])
+
+    for table, fields in acs_tables.items():
+        df[fields + ["state", "county", "tract"]].to_csv(
+            utils.raw_dir(f"{table}_{today}.csv"))
+
+
+def ingest_batch_schedule(batch, report=None):
+
+    # Boundaries first, since the routes come from the stops inside them
+    fetch.run_all([
+        functools.partial(
+            _staged, report, f"ingest_region_boundary[{region.name}]",
+            ingest_region_boundary, region)
+        for region in batch
+        if region.boundary is None
+    ])
+    _staged(report, "ingest_schedule", ingest_schedule, batch_routes(batch))
+
+
+def main(batch=(regions.berkeley,), report=None):
     # Create directories
-    output_dir = "../data/raw"
+    output_dir = "../../data/raw"
     os.makedirs(output_dir, exist_ok=True)
 
     # Load .env file
     load_dotenv(dotenv_path="../../.env")
 
-    # Ingest data
-    # ingest_schedule()
-    # ingest_vehicle_ownership()
-    # ingest_college_population()
-    pass
+    # Ingest data concurrently, one report stage per ingest function
+    fetch.run_all([
+        functools.partial(
+            _staged, report, "ingest_berkeley_boundary", ingest_berkeley_boundary),
+        functools.partial(ingest_batch_schedule, batch, report),
+        functools.partial(
+            _staged, report, "ingest_census_tables", ingest_census_tables)
+    ])
 
 
 if __name__ == "__main__":
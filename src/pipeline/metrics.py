@@ -1,21 +1,24 @@
-import pandas as pd
 import numpy as np
+import regions
+import session
+import runner
 import utils
 
 
-def population_coverage_ratio():
+@runner.task(
+    inputs=[utils.clean_dir("{region.name}_tract_population_covered.csv")]
+)
+def population_coverage_ratio(region=regions.berkeley):
 
     # Load data
-    gdf = pd.read_csv(
-        utils.clean_dir("tract_population_covered.csv")
-    )
+    gdf = session.read_csv(f"{region.name}_tract_population_covered.csv")
 
     population_covered = gdf["population_covered"].astype("float").sum()
     population_total = gdf["population"].astype("int").sum()
     coverage_ratio = np.round(population_covered / population_total * 100, 1)
 
     # Print metrics
-    print("\nCoverage Metrics")
+    print(f"\nCoverage Metrics ({region.name})")
     print("-" * 40)
     print(f"Total Population: {population_total}")
     print(f"Covered Population: {int(np.round(population_covered))}")
@@ -23,8 +26,9 @@ def population_coverage_ratio():
         f"Population Coverage Ratio: {coverage_ratio}%\n\n"
     )
 
-def main():
-    population_coverage_ratio()
+def main(batch=(regions.berkeley,)):
+    for region in batch:
+        population_coverage_ratio(region)
 
 if __name__ == "__main__":
     main()
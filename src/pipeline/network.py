@@ -0,0 +1,254 @@
+from scipy.sparse.csgraph import dijkstra
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+from typing import NamedTuple
+import numpy as np
+import networkx as nx
+import osmnx as ox
+import multiprocessing
+import functools
+import argparse
+import regions
+import shapely
+import utils
+import os
+import re
+
+
+# Bump when the prepared graph changes shape so old caches are ignored
+graph_cache_version = 1
+
+
+# CSR walk graph shared with forked worker processes
+_graph = None
+
+# Memory for one batch's dense source x node distance array, per process
+batch_memory = int(os.getenv("PIPELINE_ISOCHRONE_MB", "256")) * 2**20
+
+
+def graph_cache_path(name, network_type, speed):
+    return utils.cache_dir(
+        f"graph_{name}_{network_type}_{speed}kph_v{graph_cache_version}.graphml"
+    )
+
+
+def prepare_graph(G, speed):
+
+    # Project graph and set edge attributes
+    G = ox.projection.project_graph(G)
+    nx.set_edge_attributes(G, speed, "speed_kph")
+    G = ox.routing.add_edge_travel_times(G)
+
+    return G
+
+
+def walk_graph(
+    place="Berkeley, California, USA",
+    network_type="walk",
+    speed=5,
+    refresh=False,
+    filepath=None,
+    name=None
+):
+
+    # Local input: a prepared .graphml as-is, or raw OSM XML to prepare
+    if filepath is not None:
+        if filepath.endswith(".graphml"):
+            return ox.io.load_graphml(filepath)
+        return prepare_graph(ox.graph.graph_from_xml(filepath), speed)
+
+    # Cache name from the place (or list of places, for their union area)
+    if name is None:
+        places = [place] if isinstance(place, str) else place
+        name = re.sub(r"[^a-z0-9]+", "_", "+".join(places).lower()).strip("_")
+
+    # Reuse the cached projected, speed-annotated graph when present
+    path = graph_cache_path(name, network_type, speed)
+    if os.path.exists(path) and not refresh:
+        return ox.io.load_graphml(path)
+
+    # Download from Overpass and cache for offline runs
+    G = ox.graph.graph_from_place(place, network_type=network_type)
+    G = prepare_graph(G, speed)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ox.io.save_graphml(G, path)
+
+    return G
+
+
+class CSRGraph(NamedTuple):
+    nodes: np.ndarray  # node id at each position
+    indptr: np.ndarray  # edge offsets per source node
+    indices: np.ndarray  # edge target positions
+    weights: np.ndarray  # edge weights
+    x: np.ndarray  # node coordinates in the graph CRS
+    y: np.ndarray
+    crs: object
+
+
+def csr_graph(G, weight="time"):
+
+    # Node ids and coordinates in graph order
+    nodes = list(G.nodes)
+    position = {node: i for i, node in enumerate(nodes)}
+    x = np.fromiter((data['x'] for _, data in G.nodes(data=True)), float)
+    y = np.fromiter((data['y'] for _, data in G.nodes(data=True)), float)
+
+    # Edge list, weighted like networkx (missing attribute counts as 1)
+    sources = np.fromiter((position[u] for u, _ in G.edges()), np.int64)
+    targets = np.fromiter((position[v] for _, v in G.edges()), np.int64)
+    weights = np.fromiter(
+        (data.get(weight, 1) for _, _, data in G.edges(data=True)), float)
+
+    # Keep only the lightest of any parallel edges
+    order = np.lexsort((weights, targets, sources))
+    sources, targets, weights = sources[order], targets[order], weights[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    sources, targets, weights = sources[first], targets[first], weights[first]
+
+    # Offsets of each node's outgoing edges
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(nodes)), out=indptr[1:])
+
+    return CSRGraph(
+        nodes=np.asarray(nodes),
+        indptr=indptr,
+        indices=targets.astype(np.int32),
+        weights=weights,
+        x=x,
+        y=y,
+        crs=G.graph["crs"]
+    )
+
+
+@functools.lru_cache(maxsize=2)
+def _load_csr_graph(path, mtime, weight):
+    return csr_graph(ox.io.load_graphml(path), weight=weight)
+
+
+def load_csr_graph(path, weight="time"):
+
+    # Load a cached graph once per process and reuse its CSR arrays
+    return _load_csr_graph(path, os.path.getmtime(path), weight)
+
+
+def _matrix(graph):
+    n = len(graph.nodes)
+    return csr_matrix((graph.weights, graph.indices, graph.indptr), shape=(n, n))
+
+
+def nearest_positions(graph, x, y):
+
+    # Snap coordinates (graph CRS) to the nearest node positions
+    tree = cKDTree(np.column_stack([graph.x, graph.y]))
+    _, positions = tree.query(np.column_stack([x, y]), k=1)
+
+    return positions
+
+
+def reachable(graph, sources, radius):
+
+    # Bounded shortest-path distances from each source (inf beyond radius)
+    return dijkstra(_matrix(graph), indices=sources, limit=radius)
+
+
+def _isochrone_batch(sources, radius):
+
+    # Reachable (source, node) pairs for the whole batch
+    rows, columns = np.nonzero(np.isfinite(reachable(_graph, sources, radius)))
+
+    # Hull each source's reachable node coordinates in one call
+    points = shapely.multipoints(
+        np.column_stack([_graph.x[columns], _graph.y[columns]]),
+        indices=rows
+    )
+
+    return list(shapely.convex_hull(points))
+
+
+def isochrones(graph, sources, radius, workers=1, batch_size=None):
+    global _graph
+
+    # Batches sized so their float64 distance rows fit the memory budget
+    if batch_size is None:
+        batch_size = max(1, batch_memory // (8 * max(1, len(graph.nodes))))
+
+    # Fix the source order so serial and parallel runs match
+    sources = np.unique(sources)
+    batches = [
+        (sources[i:i + batch_size], radius)
+        for i in range(0, len(sources), batch_size)
+    ]
+
+    # Workers inherit the graph arrays on fork instead of per task
+    _graph = graph
+    try:
+        if workers > 1 and len(batches) > 1:
+            context = multiprocessing.get_context("fork")
+            with context.Pool(workers) as pool:
+                results = pool.starmap(_isochrone_batch, batches)
+        else:
+            results = [_isochrone_batch(*batch) for batch in batches]
+    finally:
+        _graph = None
+
+    return [polygon for polygons in results for polygon in polygons]
+
+
+def walkshed(graph, sources, radius):
+
+    # One bounded shortest-path pass from every stop node at once, keeping
+    # the source each reachable node is nearest to
+    distances, _, nearest = dijkstra(
+        _matrix(graph),
+        indices=np.unique(sources),
+        limit=radius,
+        min_only=True,
+        return_predecessors=True
+    )
+    nodes = np.flatnonzero(np.isfinite(distances))
+    if not len(nodes):
+        return None
+
+    # Hull the nodes nearest each source and union the hulls. Each hull only
+    # covers its own share of the reachable nodes, so the result is smaller
+    # than the union of full per-source isochrones
+    order = np.argsort(nearest[nodes], kind="stable")
+    nodes = nodes[order]
+    _, rows = np.unique(nearest[nodes], return_inverse=True)
+    points = shapely.multipoints(
+        np.column_stack([graph.x[nodes], graph.y[nodes]]),
+        indices=rows
+    )
+
+    return shapely.union_all(shapely.convex_hull(points))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Download and cache the walk network")
+    parser.add_argument("--regions", nargs="+", default=["berkeley"],
+                        choices=sorted(regions.regions))
+    parser.add_argument("--network-type", default="walk")
+    parser.add_argument("--speed", type=int, default=5)
+    parser.add_argument("--refresh", action="store_true",
+                        help="Redownload even if a cached graph exists")
+    args = parser.parse_args()
+
+    batch = [regions.regions[name] for name in args.regions]
+    name = regions.batch_name(batch)
+
+    walk_graph(
+        place=[region.place for region in batch],
+        name=name,
+        network_type=args.network_type,
+        speed=args.speed,
+        refresh=args.refresh
+    )
+    print(graph_cache_path(name, args.network_type, args.speed))
+
+
+if __name__ == "__main__":
+    main()
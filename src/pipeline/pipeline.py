@@ -1,10 +1,85 @@
+import argparse
 import ingest
-import clean
-import transform
-import metrics
+import profiling
+import session
+import regions
+import runner
+import utils
+import time
+
+# Imported for their side effect of registering tasks with the runner
+import clean  # noqa: F401
+import transform  # noqa: F401
+import metrics  # noqa: F401
+import scenarios  # noqa: F401
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the AC Transit equity pipeline")
+    parser.add_argument("--target", action="append",
+                        help="Task or output layer to bring up to date (repeatable)")
+    parser.add_argument("--force", action="store_true",
+                        help="Rerun tasks even if their outputs are up to date")
+    parser.add_argument("--ingest", action="store_true",
+                        help="Fetch raw data before running the tasks")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of independent tasks to run at once")
+    parser.add_argument("--regions", nargs="+", default=["berkeley"],
+                        choices=sorted(regions.regions),
+                        help="Regions to process in one batch")
+    parser.add_argument("--chunk-tracts", type=int,
+                        help="Area-weight blocks this many tracts at a time")
+    parser.add_argument("--isochrone-workers", type=int, default=1,
+                        help="Worker processes for per-stop isochrones")
+    parser.add_argument("--coverage-engine", default="ego",
+                        choices=["ego", "multi_source"],
+                        help="Coverage from per-stop isochrones, or from one multi-source "
+                        "walk-shed (faster, but hulls only each stop's nearest nodes, so "
+                        "coverage is smaller; scenarios always use per-stop isochrones)")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="Keep intermediate layers in memory instead of writing them")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write cProfile stats per stage next to the run report")
+    args = parser.parse_args()
+
+    # Layers only in memory cannot be shared between worker processes
+    if args.no_checkpoint and args.jobs > 1:
+        parser.error("--no-checkpoint needs --jobs 1")
+    if args.no_checkpoint:
+        session.checkpoint = False
+
+    batch = [regions.regions[name] for name in args.regions]
+
+    # One report per run, shared by ingest and the pipeline tasks
+    report = profiling.Report(
+        utils.runs_dir(time.strftime("%Y%m%d-%H%M%S")),
+        profile=args.profile
+    )
+
+    if args.ingest:
+        ingest.main(batch, report)
+
+    params = {
+        "stop_isochrones": {"workers": args.isochrone_workers},
+        "coverage": {"engine": args.coverage_engine},
+        "time_slice_coverage": {"engine": args.coverage_engine}
+    }
+
+    # Bound block-level memory by chunk size instead of region size
+    if args.chunk_tracts:
+        params["tract_population_covered"] = {"chunk_tracts": args.chunk_tracts}
+        params["time_slice_coverage"]["chunk_tracts"] = args.chunk_tracts
+
+    runner.run(
+        targets=args.target,
+        force=args.force,
+        params=params,
+        jobs=args.jobs,
+        batch=batch,
+        report=report
+    )
+
 
 if __name__ == "__main__":
-    ingest.main()
-    clean.main()
-    transform.main()
-    metrics.main()
+    main()
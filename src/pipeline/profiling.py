@@ -0,0 +1,181 @@
+from contextlib import contextmanager
+import contextvars
+import threading
+import resource
+import cProfile
+import pstats
+import time
+import json
+import os
+
+
+# Row and byte counters of the current stage; threads started through
+# fetch.run_all inherit them, so concurrent ingest stages count separately
+_lock = threading.Lock()
+_counters = contextvars.ContextVar("counters", default=None)
+
+# Stages running in this process, e.g. concurrent ingest functions
+_active = 0
+
+
+def path_size(path):
+
+    # Bytes in a file, or in every file under a directory
+    if not os.path.exists(path):
+        return 0
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    return sum(
+        os.path.getsize(os.path.join(root, filename))
+        for root, _, files in os.walk(path)
+        for filename in files
+    )
+
+
+def count(**amounts):
+
+    # Add to the current stage's counters (no-op outside a stage)
+    counters = _counters.get()
+    if counters is None:
+        return
+    with _lock:
+        for key, amount in amounts.items():
+            counters[key] += amount
+
+
+def _cpu_seconds():
+
+    # This process plus any worker processes it has waited on
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _reset_peak_rss():
+
+    # Restart this process's high-water mark (Linux only)
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def _peak_rss_mb(reset, children):
+
+    # VmHWM since the reset, else the lifetime peak (both in kilobytes)
+    peak = None
+    if reset:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1])
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Worker processes count only if one set a new peak during the stage
+    grown = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if grown > children:
+        peak = max(peak, grown)
+
+    return round(peak / 1024, 1)
+
+
+@contextmanager
+def stage(name, profile_dir=None):
+    global _active
+
+    # Rows through the session layer, and bytes downloaded (read) and
+    # saved (written) by fetch
+    record = {"stage": name, "status": "run"}
+    counters = {
+        "rows_in": 0,
+        "rows_out": 0,
+        "bytes_read": 0,
+        "bytes_written": 0
+    }
+    token = _counters.set(counters)
+
+    # The memory high-water mark is per process, so stages overlapping in
+    # threads share one peak from the first of them
+    with _lock:
+        if _active == 0:
+            reset = _reset_peak_rss()
+        else:
+            reset = os.path.exists("/proc/self/status")
+        _active += 1
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    wall, cpu = time.perf_counter(), _cpu_seconds()
+
+    # Only one profiler can be active at a time, so overlapping stages
+    # after the first go unprofiled
+    profiler = cProfile.Profile() if profile_dir else None
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            profiler = None
+
+    try:
+        yield record
+    except BaseException as error:
+        record["status"] = f"failed: {type(error).__name__}: {error}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+
+        with _lock:
+            record.update(counters)
+            _active -= 1
+        _counters.reset(token)
+
+        record.update(
+            wall_seconds=round(time.perf_counter() - wall, 3),
+            cpu_seconds=round(_cpu_seconds() - cpu, 3),
+            peak_rss_mb=_peak_rss_mb(reset, children)
+        )
+
+        # Raw stats for snakeviz and friends, plus a readable summary
+        if profiler is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, name)
+            profiler.dump_stats(f"{path}.prof")
+            with open(f"{path}.txt", "w") as file:
+                pstats.Stats(profiler, stream=file).sort_stats(
+                    "cumulative").print_stats(40)
+
+
+class Report:
+
+    # One JSON line per stage under a per-run directory
+    def __init__(self, directory, profile=False):
+        self.directory = directory
+        self.path = os.path.join(directory, "report.jsonl")
+        self.profile = profile
+        self.lock = threading.Lock()
+
+    def profile_dir(self):
+        return os.path.join(self.directory, "profiles") if self.profile else None
+
+    def write(self, record):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, "a") as file:
+                file.write(json.dumps(record) + "\n")
+
+    @contextmanager
+    def stage(self, name):
+
+        # Profile a stage in this process and record it even if it fails
+        record = None
+        try:
+            with stage(name, self.profile_dir()) as record:
+                yield record
+        finally:
+            if record is not None:
+                self.write(record)
@@ -0,0 +1,38 @@
+from typing import NamedTuple
+
+
+class Region(NamedTuple):
+    name: str  # prefix for the region's output layers
+    place: str  # OSM place name for the walk network
+    population: int = None  # 2020 Census population, asserted when known
+    boundary: str = None  # raw land boundary file (defaults to <name>_boundary.geojson)
+
+    @property
+    def boundary_file(self):
+        return self.boundary or f"{self.name}_boundary.geojson"
+
+
+berkeley = Region(
+    name="berkeley",
+    place="Berkeley, California, USA",
+    population=124321,
+    boundary="Land_Boundary_20251109.geojson"
+)
+
+oakland = Region(name="oakland", place="Oakland, California, USA")
+
+emeryville = Region(name="emeryville", place="Emeryville, California, USA")
+
+albany = Region(name="albany", place="Albany, California, USA")
+
+# Regions selectable for a batch run
+regions = {
+    region.name: region
+    for region in (berkeley, oakland, emeryville, albany)
+}
+
+
+def batch_name(batch):
+
+    # Name shared outputs (e.g. the walk graph) by the regions they cover
+    return "+".join(sorted(region.name for region in batch))
@@ -0,0 +1,394 @@
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import NamedTuple, Callable
+from contextlib import nullcontext
+import multiprocessing
+import functools
+import profiling
+import session
+import hashlib
+import inspect
+import regions
+import utils
+import json
+import types
+import time
+import sys
+import os
+
+
+class Task(NamedTuple):
+    name: str
+    func: Callable
+    inputs: tuple
+    outputs: tuple
+    base: str = None  # registered function name
+    params: dict = {}  # region / batch arguments for this instance
+    when: dict = {}  # input -> predicate on the task's arguments
+
+
+# Tasks in declaration order (clean, then transform, then metrics)
+registry = {}
+
+# Input hashes and task signatures from previous runs
+state_path = utils.cache_dir("pipeline_state.json")
+
+
+def task(inputs=(), outputs=(), when=None):
+
+    # Register a pipeline function with its input and output files
+    # (inputs listed in when are only read if their predicate holds, and
+    # callable inputs are resolved each time tasks are expanded)
+    def register(func):
+        registry[func.__name__] = Task(
+            name=func.__name__,
+            func=func,
+            inputs=tuple(inputs),
+            outputs=tuple(outputs),
+            when=dict(when or {})
+        )
+        return func
+
+    return register
+
+
+def _load_state():
+    if not os.path.exists(state_path):
+        return {"files": {}, "tasks": {}}
+
+    with open(state_path, "r") as file:
+        return json.load(file)
+
+
+def _save_state(state):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+
+    # Write then rename so an interrupted run keeps the old state
+    tmp = f"{state_path}.tmp"
+    with open(tmp, "w") as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(tmp, state_path)
+
+
+def _input_hash(path, state):
+    if not os.path.exists(path):
+        return None
+
+    # Directories (e.g. per-route schedules) are hashed in full
+    if os.path.isdir(path):
+        return utils.path_hash(path)
+
+    # Rehash only when size or modification time changed
+    stat = os.stat(path)
+    cached = state["files"].get(path)
+    if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+        return cached["hash"]
+
+    digest = utils.file_hash(path)
+    state["files"][path] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "hash": digest
+    }
+    return digest
+
+
+@functools.lru_cache(maxsize=None)
+def _code_hash(module_name):
+
+    # Source of the task's module and every pipeline module it imports,
+    # so edits to shared helpers or constants also rerun the task
+    directory = os.path.dirname(os.path.abspath(__file__))
+    pending = [sys.modules[module_name]]
+    sources = {}
+    while pending:
+        module = pending.pop()
+        path = getattr(module, "__file__", None)
+        if path is None or os.path.dirname(os.path.abspath(path)) != directory \
+                or module.__name__ in sources:
+            continue
+
+        sources[module.__name__] = utils.file_hash(path)
+        pending.extend(
+            value for value in vars(module).values()
+            if isinstance(value, types.ModuleType)
+        )
+
+    return hashlib.sha256(
+        json.dumps(sources, sort_keys=True).encode()).hexdigest()
+
+
+def _signature(task, params, state):
+
+    # Inputs, parameters and the code the task runs
+    payload = {
+        "inputs": {path: _input_hash(path, state) for path in task.inputs},
+        "params": {key: repr(value) for key, value in sorted(params.items())},
+        "code": _code_hash(task.func.__module__)
+    }
+
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _resolve(path):
+    return path() if callable(path) else path
+
+
+def expand(batch, params=None):
+
+    # Per-region tasks (paths with {region...}) run once per region
+    params = params or {}
+    name = regions.batch_name(batch)
+    tasks = []
+    for template in registry.values():
+        paths = template.inputs + template.outputs
+        per_region = any("{region" in _resolve(path) for path in paths)
+        parameters = inspect.signature(template.func).parameters
+        takes_batch = "batch" in parameters
+        defaults = {
+            key: parameter.default
+            for key, parameter in parameters.items()
+            if parameter.default is not inspect.Parameter.empty
+        }
+
+        for region in (batch if per_region else [None]):
+            instance = {}
+            if region is not None:
+                instance["region"] = region
+            if takes_batch:
+                instance["batch"] = tuple(batch)
+
+            # Conditional inputs follow the arguments the task will get
+            arguments = {**defaults, **instance, **params.get(template.name, {})}
+
+            tasks.append(Task(
+                name=f"{template.name}[{region.name}]" if region else template.name,
+                func=template.func,
+                inputs=tuple(
+                    _resolve(path).format(region=region, batch=name)
+                    for path in template.inputs
+                    if path not in template.when or template.when[path](arguments)
+                ),
+                outputs=tuple(
+                    path.format(region=region, batch=name)
+                    for path in template.outputs
+                ),
+                base=template.name,
+                params=instance
+            ))
+
+    return tasks
+
+
+def _matches(task, target):
+    layers = [
+        os.path.splitext(os.path.basename(output))[0]
+        for output in task.outputs
+    ]
+
+    # Region outputs also match without their region prefix
+    region = task.params.get("region")
+    if region is not None:
+        layers += [
+            layer[len(region.name) + 1:]
+            for layer in layers
+            if layer.startswith(f"{region.name}_")
+        ]
+
+    return target in (task.name, task.base) or target in layers
+
+
+def plan(targets=None, batch=(regions.berkeley,), params=None):
+
+    tasks = expand(batch, params)
+    if not targets:
+        return tasks
+
+    # Producer of each output file
+    producers = {
+        output: task.name
+        for task in tasks
+        for output in task.outputs
+    }
+    by_name = {task.name: task for task in tasks}
+
+    # Walk back from the targets through their inputs
+    selected = set()
+    pending = []
+    for target in targets:
+        matched = [task.name for task in tasks if _matches(task, target)]
+        if not matched:
+            raise ValueError(f"Unknown pipeline target: {target}")
+        pending.extend(matched)
+
+    while pending:
+        name = pending.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        pending.extend(
+            producers[path]
+            for path in by_name[name].inputs
+            if path in producers
+        )
+
+    return [task for task in tasks if task.name in selected]
+
+
+def _upstream(task, tasks):
+
+    # Selected tasks producing any of this task's inputs
+    return {
+        other.name
+        for other in tasks
+        if other.name != task.name
+        and set(other.outputs) & set(task.inputs)
+    }
+
+
+def _execute(base, params, name, profile_dir=None):
+
+    # Time and count the task where it runs, then report back
+    with profiling.stage(name, profile_dir) as record:
+        registry[base].func(**params)
+
+    return record
+
+
+def run(targets=None, force=False, params=None, jobs=1, batch=(regions.berkeley,), report=None):
+
+    params = params or {}
+    state = _load_state()
+
+    # JSON-lines report for this run under data/runs
+    report = report or profiling.Report(
+        utils.runs_dir(time.strftime("%Y%m%d-%H%M%S")))
+
+    tasks = plan(targets, batch, params)
+    upstream = {task.name: _upstream(task, tasks) for task in tasks}
+
+    pending = list(tasks)
+    running = {}
+    status = {}
+    signatures = {}
+
+    # Without checkpoints: outputs of this run held only in memory, tasks
+    # that read them, and tasks whose outputs are not on disk yet
+    in_memory = set()
+    stale = set()
+    deferred = set()
+
+    # Independent tasks run concurrently, each once its inputs are ready
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) if jobs > 1 else nullcontext() as pool:
+        while pending or running:
+
+            for task in list(pending):
+                blocked = upstream[task.name] - {
+                    name for name, result in status.items() if result in ("run", "skip")
+                }
+                failed = [
+                    name for name in upstream[task.name]
+                    if status.get(name, "").startswith("failed")
+                    or status.get(name, "").startswith("blocked")
+                ]
+
+                if failed:
+                    status[task.name] = f"blocked by {', '.join(sorted(failed))}"
+                    pending.remove(task)
+                    continue
+
+                if blocked:
+                    continue
+
+                pending.remove(task)
+                task_params = {**task.params, **params.get(task.base, {})}
+                signatures[task.name] = _signature(task, task_params, state)
+
+                # Inputs produced in memory this run differ from their files
+                in_memory = session.unsaved(in_memory)
+                if set(task.inputs) & in_memory:
+                    stale.add(task.name)
+
+                # Skip tasks whose outputs exist and whose inputs are unchanged
+                up_to_date = (
+                    not force
+                    and task.name not in stale
+                    and task.outputs
+                    and all(os.path.exists(path) for path in task.outputs)
+                    and state["tasks"].get(task.name) == signatures[task.name]
+                )
+                if up_to_date:
+                    status[task.name] = "skip"
+                    continue
+
+                print(f"[run] {task.name}")
+                arguments = (task.base, task_params,
+                             task.name, report.profile_dir())
+                if pool is None:
+                    future = Future()
+                    try:
+                        future.set_result(_execute(*arguments))
+                    except Exception as e:
+                        future.set_exception(e)
+                else:
+                    future = pool.submit(_execute, *arguments)
+                running[future] = task
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                name = task.name
+                error = future.exception()
+                if error is not None:
+                    status[name] = f"failed: {type(error).__name__}: {error}"
+                    continue
+
+                # Sizes of the task's declared files, not bytes actually moved
+                record = future.result()
+                record["declared_input_bytes"] = sum(
+                    profiling.path_size(path) for path in task.inputs)
+                record["declared_output_bytes"] = sum(
+                    profiling.path_size(path) for path in task.outputs)
+                report.write(record)
+
+                status[name] = "run"
+
+                # Only record signatures that match the files on disk
+                unsaved = session.unsaved(task.outputs)
+                in_memory |= unsaved
+                if name in stale or unsaved:
+                    state["tasks"].pop(name, None)
+                    if name not in stale:
+                        deferred.add(name)
+                else:
+                    state["tasks"][name] = signatures[name]
+                _save_state(state)
+
+    # Outputs no selected task reads always end up on disk
+    consumed = {path for task in tasks for path in task.inputs}
+    session.flush(
+        path for task in tasks for path in task.outputs if path not in consumed)
+
+    # Tasks whose outputs have been written since they ran
+    for task in tasks:
+        if task.name in deferred and not session.unsaved(task.outputs):
+            state["tasks"][task.name] = signatures[task.name]
+    _save_state(state)
+
+    # Report per task in plan order
+    for task in tasks:
+        print(f"[{status[task.name]}] {task.name}")
+        if status[task.name] != "run":
+            report.write({"stage": task.name, "status": status[task.name]})
+    print(f"Run report: {report.path}")
+
+    failures = [
+        task.name for task in tasks
+        if status[task.name] not in ("run", "skip")
+    ]
+    if failures:
+        raise RuntimeError(f"Pipeline tasks failed: {', '.join(failures)}")
@@ -0,0 +1,229 @@
+from scipy.sparse import csr_matrix
+from typing import NamedTuple
+import pandas as pd
+import numpy as np
+import argparse
+import shapely
+import transform
+import schedule
+import regions
+import session
+import runner
+import utils
+
+
+# Block fragments reachable from each stop, with their population weights
+class Reachability(NamedTuple):
+    matrix: object  # fragments x isochrones, sparse
+    population: np.ndarray  # area-weighted population per fragment
+    tract: np.ndarray  # tract position per fragment
+    tracts: np.ndarray  # tract labels
+    tract_population: np.ndarray  # total population per tract
+    stop_ids: np.ndarray
+    stop_isochrone: np.ndarray  # isochrone position per stop
+    routes: object  # stops x routes, sparse
+    route_ids: np.ndarray
+
+
+def reachability_path(region):
+    return utils.clean_dir(f"{region.name}_reachability.npz")
+
+
+def fragments(blocks, isochrones):
+
+    # Node block and isochrone outlines together and polygonize the faces
+    lines = shapely.union_all(np.concatenate([
+        shapely.boundary(blocks),
+        shapely.boundary(isochrones)
+    ]))
+    faces = shapely.get_parts(
+        shapely.polygonize(shapely.get_parts(lines)))
+
+    # Each face lies in one block and inside a fixed set of isochrones
+    points = shapely.point_on_surface(faces)
+    face_block = shapely.STRtree(blocks).query(points, predicate="within")
+    face_isochrone = shapely.STRtree(isochrones).query(
+        points, predicate="within")
+
+    return faces, face_block, face_isochrone
+
+
+@runner.task(
+    inputs=[
+        utils.clean_path("block_population"),
+        utils.clean_path("{region.name}_tracts"),
+        utils.clean_path("{region.name}_boundary"),
+        utils.clean_path("{region.name}_stops"),
+        utils.clean_path("{region.name}_stop_isochrones")
+    ],
+    outputs=[utils.clean_dir("{region.name}_reachability.npz")]
+)
+def reachability(region=regions.berkeley):
+
+    # Load the region's blocks, clipped to land and projected
+    blocks = transform.load_region_blocks(region).reset_index(drop=True)
+
+    # Load per-stop isochrones, one polygon per snapped node
+    isochrones = session.read(f"{region.name}_stop_isochrones")
+    isochrones = isochrones.to_crs(epsg=3310)
+    _, stop_isochrone = np.unique(
+        isochrones["source"], return_inverse=True)
+    polygons = np.asarray(
+        isochrones.drop_duplicates("source").sort_values("source").geometry.array)
+
+    # Split blocks into fragments along isochrone outlines
+    block_geometries = np.asarray(blocks.geometry.array)
+    faces, face_block, face_isochrone = fragments(
+        block_geometries, polygons)
+
+    # Keep fragments inside a block, numbered in face order
+    in_block = np.full(len(faces), -1)
+    in_block[face_block[0]] = face_block[1]
+    kept = np.flatnonzero(in_block >= 0)
+    position = np.full(len(faces), -1)
+    position[kept] = np.arange(len(kept))
+
+    # Fragment population by its share of the block's area
+    block_index = in_block[kept]
+    block_area = shapely.area(block_geometries)[block_index]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = shapely.area(faces[kept]) / block_area
+    population = np.nan_to_num(
+        blocks["population"].to_numpy(dtype=float)[block_index] * share)
+
+    # Fragments x isochrones incidence
+    pairs = position[face_isochrone[0]] >= 0
+    rows = position[face_isochrone[0][pairs]]
+    columns = face_isochrone[1][pairs]
+
+    # Tract of each fragment and total population per tract
+    tracts, block_tract = np.unique(
+        blocks["tract"].astype("string").to_numpy(dtype=str),
+        return_inverse=True)
+    tract_population = np.bincount(
+        block_tract,
+        weights=blocks["population"].to_numpy(dtype=float),
+        minlength=len(tracts))
+
+    # Stops x routes incidence, in the stop order of the isochrones layer
+    stops = session.read(f"{region.name}_stops")
+    stop_positions, route_codes, route_ids = schedule.route_incidence(
+        stops["routes"])
+
+    # Export the matrix and its labels
+    np.savez(
+        reachability_path(region),
+        rows=rows,
+        columns=columns,
+        isochrones=len(polygons),
+        population=population,
+        tract=block_tract[block_index],
+        tracts=tracts,
+        tract_population=tract_population,
+        stop_ids=isochrones["stop_id"].to_numpy(dtype=str),
+        stop_isochrone=stop_isochrone,
+        stop_positions=stop_positions,
+        route_codes=route_codes,
+        route_ids=route_ids.to_numpy(dtype=str)
+    )
+
+
+def load_reachability(region=regions.berkeley):
+
+    with np.load(reachability_path(region)) as data:
+        shape = len(data["population"]), int(data["isochrones"])
+        stops = len(data["stop_ids"])
+
+        return Reachability(
+            matrix=csr_matrix(
+                (np.ones(len(data["rows"]), dtype=np.int32),
+                 (data["rows"], data["columns"])),
+                shape=shape
+            ),
+            population=data["population"],
+            tract=data["tract"],
+            tracts=data["tracts"],
+            tract_population=data["tract_population"],
+            stop_ids=data["stop_ids"],
+            stop_isochrone=data["stop_isochrone"],
+            routes=csr_matrix(
+                (np.ones(len(data["route_codes"]), dtype=np.int32),
+                 (data["stop_positions"], data["route_codes"])),
+                shape=(stops, len(data["route_ids"]))
+            ),
+            route_ids=data["route_ids"]
+        )
+
+
+def remove_stops(reach, stop_ids, active=None):
+
+    # Stops still in service after removing the given stops
+    active = np.ones(len(reach.stop_ids), dtype=bool) if active is None else active
+    return active & ~np.isin(reach.stop_ids, list(stop_ids))
+
+
+def cut_routes(reach, route_ids, active=None):
+
+    # Stops keep service while any of their routes is left
+    active = np.ones(len(reach.stop_ids), dtype=bool) if active is None else active
+    remaining = ~np.isin(reach.route_ids, list(route_ids))
+    served = reach.routes @ remaining.astype(np.int32) > 0
+    unrouted = np.diff(reach.routes.indptr) == 0
+
+    return active & (served | unrouted)
+
+
+def covered_population(reach, active=None):
+
+    # Isochrones of the stops in service
+    isochrones = np.zeros(reach.matrix.shape[1], dtype=np.int32)
+    if active is None:
+        isochrones[reach.stop_isochrone] = 1
+    else:
+        isochrones[reach.stop_isochrone[active]] = 1
+
+    # A fragment counts once if any active isochrone covers it
+    covered = reach.matrix @ isochrones > 0
+    population_covered = np.bincount(
+        reach.tract,
+        weights=reach.population * covered,
+        minlength=len(reach.tracts))
+
+    return pd.DataFrame({
+        "tract": pd.array(reach.tracts, dtype="string"),
+        "population": reach.tract_population,
+        "population_covered": population_covered
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Population covered after removing stops or cutting routes")
+    parser.add_argument("--region", default="berkeley",
+                        choices=sorted(regions.regions))
+    parser.add_argument("--remove-stops", nargs="+", default=[])
+    parser.add_argument("--cut-routes", nargs="+", default=[])
+    args = parser.parse_args()
+
+    reach = load_reachability(regions.regions[args.region])
+
+    # Compare the scenario against full service
+    active = remove_stops(reach, args.remove_stops)
+    active = cut_routes(reach, args.cut_routes, active)
+    baseline = covered_population(reach)
+    scenario = covered_population(reach, active)
+
+    scenario["baseline_covered"] = baseline["population_covered"]
+    scenario["change"] = scenario["population_covered"] - \
+        scenario["baseline_covered"]
+
+    print(scenario[scenario["change"] != 0].to_string(index=False))
+    print(
+        f"\nCovered Population: {int(np.round(baseline['population_covered'].sum()))}"
+        f" -> {int(np.round(scenario['population_covered'].sum()))}"
+        f" ({active.sum()} of {len(active)} stops in service)"
+    )
+
+
+if __name__ == "__main__":
+    main()
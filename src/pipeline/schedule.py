@@ -0,0 +1,359 @@
+from typing import NamedTuple
+from array import array
+import pandas as pd
+import numpy as np
+import shutil
+import utils
+import json
+import glob
+import os
+
+
+# One scheduled stop time, flattened out of the nested schedule JSON
+class StopTimeRecord(NamedTuple):
+    route: str
+    direction: str
+    trip: str
+    start_time: str
+    stop_id: str
+    stop_time: str
+
+
+# Incremental reader over a JSON text stream, decoding one value at a time
+class _JSONStream:
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, file, chunk_size=1 << 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def _fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self._fill():
+                raise ValueError("Unexpected end of schedule JSON")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(
+                f"Expected {char!r} in schedule JSON, got {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        while True:
+            self.peek()
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Value continues past the buffered text
+                if not self._fill():
+                    raise
+                continue
+
+            # A trailing number may continue in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def _sequence(self, open_char, close_char):
+        self.expect(open_char)
+        if self.peek() == close_char:
+            self.pos += 1
+            return
+
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == close_char:
+                return
+            if char != ",":
+                raise ValueError(
+                    f"Expected ',' or {close_char!r} in schedule JSON, got {char!r}")
+
+    def elements(self):
+        # Leaves the reader at each array element in turn
+        yield from self._sequence("[", "]")
+
+    def members(self):
+        # Yields each object key, leaving the reader at its value
+        for _ in self._sequence("{", "}"):
+            key = self.value()
+            self.expect(":")
+            yield key
+
+
+def _records(route, trip):
+    for arrival in trip.get("StopTimes") or []:
+        yield StopTimeRecord(
+            route=route.get("RouteId"),
+            direction=trip.get("Direction", route.get("Direction")),
+            trip=trip.get("TripId"),
+            start_time=trip.get("StartTime"),
+            stop_id=arrival.get("StopId"),
+            stop_time=arrival.get("StopTime")
+        )
+
+
+def _routes(stream):
+    if stream.peek() != "[":
+        stream.value()
+        return
+
+    for _ in stream.elements():
+        yield from _route(stream)
+
+
+def _route(stream):
+    if stream.peek() != "{":
+        stream.value()
+        return
+
+    # Route fields and any trips read before the route id
+    route = {}
+    pending = []
+
+    for key in stream.members():
+        if key == "Routes":
+            yield from _routes(stream)
+
+        elif key == "Trips" and stream.peek() == "[":
+            for _ in stream.elements():
+                trip = stream.value()
+                if "RouteId" in route:
+                    yield from _records(route, trip)
+                else:
+                    pending.append(trip)
+
+        else:
+            route[key] = stream.value()
+
+    for trip in pending:
+        yield from _records(route, trip)
+
+
+def iter_stop_times(path):
+
+    # A directory of per-route schedule files is read file by file
+    if os.path.isdir(path):
+        for filepath in sorted(glob.glob(os.path.join(path, "*.json"))):
+            yield from iter_stop_times(filepath)
+        return
+
+    # Stream stop time records one trip at a time
+    with open(path, "r") as file:
+        stream = _JSONStream(file)
+
+        if stream.peek() == "[":
+            yield from _routes(stream)
+        else:
+            yield from _route(stream)
+
+
+def schedule_index(records):
+
+    # Integer codes for route, trip and stop ids
+    routes, trips, stops = {}, {}, {}
+    route_codes, trip_codes, stop_codes = array("i"), array("i"), array("i")
+    start_minutes, minutes = array("h"), array("h")
+
+    # Helper: Code an id, treating a missing id as an empty string
+    def code(codes, value):
+        value = "" if value is None else str(value)
+        return codes.setdefault(value, len(codes))
+
+    for record in records:
+        route_codes.append(code(routes, record.route))
+        trip_codes.append(code(trips, record.trip))
+        stop_codes.append(code(stops, record.stop_id))
+
+        # Minutes since midnight from "HH:MM" and "YYYY-MM-DDTHH:MM:SS"
+        start_minutes.append(
+            int(record.start_time[:2]) * 60 + int(record.start_time[3:5]))
+        minutes.append(
+            int(record.stop_time[11:13]) * 60 + int(record.stop_time[14:16]))
+
+    columns = {
+        "route": np.asarray(route_codes, dtype=np.int16),
+        "trip": np.asarray(trip_codes, dtype=np.int32),
+        "stop_id": np.asarray(stop_codes, dtype=np.int32),
+        "start_minute": np.asarray(start_minutes, dtype=np.int16),
+        "minute": np.asarray(minutes, dtype=np.int16)
+    }
+    labels = {
+        "route": list(routes),
+        "trip": list(trips),
+        "stop_id": list(stops)
+    }
+
+    return _index_frame(columns, labels)
+
+
+def _index_frame(columns, labels):
+
+    # Categorical id columns over the coded arrays
+    index = pd.DataFrame({
+        name: (
+            pd.Categorical.from_codes(
+                codes,
+                categories=pd.Index(labels[name], dtype="string")
+            )
+            if name in labels
+            else codes
+        )
+        for name, codes in columns.items()
+    }, copy=False)
+
+    return index
+
+
+def _write_index_cache(cache, index):
+
+    # Write to a temporary directory, then move it into place
+    tmp = f"{cache}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+
+    labels = {}
+    for name in index.columns:
+        column = index[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            labels[name] = column.cat.categories.tolist()
+            values = column.cat.codes.to_numpy()
+        else:
+            values = column.to_numpy()
+        np.save(os.path.join(tmp, f"{name}.npy"), values)
+
+    with open(os.path.join(tmp, "labels.json"), "w") as file:
+        json.dump({"columns": list(index.columns), "labels": labels}, file)
+
+    # Another process may have published the same cache first; keep theirs
+    try:
+        os.replace(tmp, cache)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(cache):
+            raise
+
+
+def _read_index_cache(cache):
+
+    with open(os.path.join(cache, "labels.json"), "r") as file:
+        meta = json.load(file)
+
+    # Memory-map each column instead of reading it
+    columns = {
+        name: np.load(os.path.join(cache, f"{name}.npy"), mmap_mode="r")
+        for name in meta["columns"]
+    }
+
+    return _index_frame(columns, meta["labels"])
+
+
+def load_schedule_index(path):
+
+    # Cache directory next to the raw schedule, keyed on its content hash
+    path = path.rstrip(os.sep)
+    digest = utils.path_hash(path)[:16]
+    cache = f"{path}.{digest}.index"
+
+    if os.path.isdir(cache):
+        return _read_index_cache(cache)
+
+    index = schedule_index(iter_stop_times(path))
+
+    # Drop caches built from earlier versions of the file, never this one
+    for stale in glob.glob(f"{glob.escape(path)}.*.index"):
+        if stale != cache:
+            shutil.rmtree(stale, ignore_errors=True)
+
+    _write_index_cache(cache, index)
+
+    return _read_index_cache(cache)
+
+
+def route_incidence(routes, labels=None):
+
+    # Space-delimited route lists as one route column per position
+    table = (
+        routes.reset_index(drop=True)
+        .astype("string")
+        .str.split(" ", expand=True)
+        .fillna("")
+    )
+    values = table.to_numpy(dtype=object).ravel()
+    positions = np.repeat(np.arange(len(table)), table.shape[1])
+    present = values != ""
+
+    # Code routes against the given labels (e.g. the schedule's), or their own
+    if labels is None:
+        labels = pd.Index(np.unique(values[present].astype(str)), dtype="string")
+    codes = labels.get_indexer(values[present])
+    known = codes >= 0
+
+    # Exploded (stop position, route code) pairs
+    return positions[present][known], codes[known], labels
+
+
+def stop_hour_arrivals(index, stops):
+
+    # Only count a stop time in the hour its trip departs
+    hour = index["minute"].to_numpy() // 60
+    departs = index["start_minute"].to_numpy() // 60 == hour
+    route_codes = index["route"].cat.codes.to_numpy()[departs]
+    stop_codes = index["stop_id"].cat.codes.to_numpy()[departs]
+    hour = hour[departs]
+
+    # Count arrivals per route, stop and hour on one combined integer key
+    route_labels = index["route"].cat.categories
+    stop_labels = index["stop_id"].cat.categories
+    keys, counts = np.unique(
+        (route_codes.astype(np.int64) * len(stop_labels) + stop_codes) * 24 + hour,
+        return_counts=True
+    )
+
+    # Each stop and route serving it, as schedule codes
+    served, served_routes, _ = route_incidence(stops["routes"], route_labels)
+    served_stops = stop_labels.get_indexer(
+        stops["stop_id"].astype("string"))[served]
+    scheduled = served_stops >= 0
+
+    # Look up each served pair's count for all 24 hours at once
+    keys = np.append(keys, np.iinfo(np.int64).max)
+    counts = np.append(counts, 0)
+    pair_keys = served_routes[scheduled].astype(np.int64) * len(stop_labels) + \
+        served_stops[scheduled]
+    lookup = pair_keys[:, None] * 24 + np.arange(24)
+    positions = np.searchsorted(keys, lookup)
+    pair_counts = np.where(keys[positions] == lookup, counts[positions], 0)
+
+    # Sum arrivals over the routes serving each stop into a stop x hour matrix
+    matrix = np.zeros((len(stops), 24), dtype=np.int64)
+    np.add.at(matrix, served[scheduled], pair_counts)
+
+    # One row per stop and hour, in stop order
+    arrivals = pd.DataFrame({
+        "stop_id": stops["stop_id"].repeat(24).reset_index(drop=True),
+        "hour": np.tile(np.arange(24), len(stops)),
+        "arrivals": matrix.ravel()
+    })
+
+    return arrivals
@@ -0,0 +1,227 @@
+from collections import OrderedDict
+from typing import NamedTuple, Callable
+import pandas as pd
+import profiling
+import utils
+import os
+
+
+# Also write every layer to disk (off: only spill when evicted)
+checkpoint = os.getenv("PIPELINE_CHECKPOINT", "1") == "1"
+
+# Memory budget for cached frames in this process
+memory_limit = int(os.getenv("PIPELINE_SESSION_MB", "2048")) * 2**20
+
+# Id columns coded against one shared, sorted dictionary per column
+code_columns = ("tract", "stop_id")
+
+# Label columns held as pandas strings
+string_columns = ("time_block",)
+
+# Labels seen so far for each coded column
+dictionaries = {
+    column: pd.Index([], dtype="string")
+    for column in code_columns
+}
+
+
+class Entry(NamedTuple):
+    frame: pd.DataFrame
+    path: str
+    mtime: int  # file version the frame matches (None if not on disk)
+    size: int  # bytes in memory
+    save: Callable = None  # writes the frame if it is not on disk yet
+
+
+# Cached frames, least recently used first
+_entries = OrderedDict()
+
+
+def _mtime(path):
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+def _recode(column):
+
+    # Move cached frames onto the grown dictionary
+    for entry in _entries.values():
+        if column in entry.frame.columns:
+            entry.frame[column] = entry.frame[column].cat.set_categories(
+                dictionaries[column])
+
+
+def _normalize(frame):
+
+    # Integer codes over the shared dictionary, so joins compare codes
+    for column in code_columns:
+        if column not in frame.columns:
+            continue
+
+        values = frame[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) and \
+                values.cat.categories.equals(dictionaries[column]):
+            continue
+
+        values = values.astype("string")
+        labels = pd.Index(values.dropna().unique(), dtype="string")
+        new = labels.difference(dictionaries[column])
+        if len(new):
+            dictionaries[column] = dictionaries[column].union(new).sort_values()
+            _recode(column)
+
+        frame[column] = pd.Categorical(
+            values, categories=dictionaries[column])
+
+    # One dtype per label column, set once instead of in every stage
+    for column in string_columns:
+        if column in frame.columns and frame[column].dtype != "string":
+            frame[column] = frame[column].astype("string")
+
+    return frame
+
+
+def _external(frame):
+
+    # On disk, coded columns stay plain strings
+    return frame.astype({
+        column: "string"
+        for column in code_columns
+        if column in frame.columns
+    })
+
+
+def _put(key, path, frame, save=None):
+    _entries.pop(key, None)
+    _entries[key] = Entry(
+        frame=frame,
+        path=path,
+        mtime=_mtime(path) if save is None else None,
+        size=int(frame.memory_usage(deep=True).sum()),
+        save=save
+    )
+
+    # Evict least recently used frames over budget, spilling unsaved ones
+    total = sum(entry.size for entry in _entries.values())
+    while total > memory_limit and len(_entries) > 1:
+        _, entry = _entries.popitem(last=False)
+        if entry.save is not None:
+            entry.save()
+        total -= entry.size
+
+
+def _get(key, path, load):
+    entry = _entries.get(key)
+
+    # Reload frames whose file was rewritten, e.g. by another worker
+    if entry is None or (entry.save is None and entry.mtime != _mtime(path)):
+        _put(key, path, _normalize(load()))
+    else:
+        _entries.move_to_end(key)
+
+    # Callers get their own columns over the shared data
+    return _entries[key].frame.copy(deep=False)
+
+
+def read(name):
+
+    # Rows count as read whether they come from memory or disk
+    gdf = _get(
+        ("layer", name),
+        utils.clean_path(name),
+        lambda: utils.read_clean(name)
+    )
+    profiling.count(rows_in=len(gdf))
+
+    return gdf
+
+
+def read_csv(filename):
+    df = _get(
+        ("csv", filename),
+        utils.clean_dir(filename),
+        lambda: pd.read_csv(
+            utils.clean_dir(filename),
+            dtype={
+                column: "string"
+                for column in code_columns + string_columns
+            }
+        )
+    )
+    profiling.count(rows_in=len(df))
+
+    return df
+
+
+def read_rows(name, column, values):
+
+    # Stream only the requested rows from disk, never the cached whole layer,
+    # and drop that layer since callers read in chunks to avoid holding it
+    path = utils.clean_path(name)
+    entry = _entries.get(("layer", name))
+    if entry is not None and entry.save is not None:
+        flush([path])
+    _entries.pop(("layer", name), None)
+
+    gdf = _normalize(utils.read_clean_rows(name, column, values))
+    profiling.count(rows_in=len(gdf))
+
+    return gdf
+
+
+def write(gdf, name):
+
+    # Same frame as reading the file back would give
+    gdf = _normalize(gdf.reset_index(drop=True))
+
+    def save():
+        utils.export_clean(_external(gdf), name)
+
+    profiling.count(rows_out=len(gdf))
+    if checkpoint:
+        save()
+    _put(("layer", name), utils.clean_path(name), gdf,
+         None if checkpoint else save)
+
+
+def write_csv(df, filename):
+
+    df = _normalize(df.reset_index(drop=True))
+
+    def save():
+        _external(df).to_csv(utils.clean_dir(filename), index=False)
+
+    profiling.count(rows_out=len(df))
+    if checkpoint:
+        save()
+    _put(("csv", filename), utils.clean_dir(filename), df,
+         None if checkpoint else save)
+
+
+def invalidate(name=None):
+
+    # Drop one layer or CSV (by name or filename), or everything
+    if name is None:
+        _entries.clear()
+    else:
+        _entries.pop(("layer", name), None)
+        _entries.pop(("csv", name), None)
+
+
+def unsaved(paths):
+
+    # Paths among these whose frames are only in memory so far
+    paths = set(paths)
+    return {
+        entry.path for entry in _entries.values()
+        if entry.save is not None and entry.path in paths
+    }
+
+
+def flush(paths=None):
+
+    # Write frames not yet on disk (all, or those for the given paths)
+    paths = None if paths is None else set(paths)
+    for key, entry in list(_entries.items()):
+        if entry.save is not None and (paths is None or entry.path in paths):
+            entry.save()
+            _entries[key] = entry._replace(save=None, mtime=_mtime(entry.path))
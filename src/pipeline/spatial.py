@@ -0,0 +1,33 @@
+import pandas as pd
+import numpy as np
+import shapely
+
+
+def area_ratio(geometries, coverage):
+
+    # Share of each geometry's area inside the coverage polygon
+    geometries = np.asarray(geometries.array)
+    area = shapely.area(geometries)
+    ratio = np.zeros(len(geometries))
+
+    # Candidate geometries touching any part of the coverage polygon
+    tree = shapely.STRtree(shapely.get_parts(coverage))
+    candidates = np.unique(
+        tree.query(geometries, predicate="intersects")[0])
+
+    # Fully covered geometries need no intersection
+    shapely.prepare(coverage)
+    covered = shapely.covers(coverage, geometries[candidates])
+    ratio[candidates[covered]] = 1.0
+
+    # Exact intersection only on the boundary geometries
+    boundary = candidates[~covered]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio[boundary] = shapely.area(
+            shapely.intersection(geometries[boundary], coverage)
+        ) / area[boundary]
+
+    # Zero-area geometries have no defined ratio
+    ratio[area == 0] = np.nan
+
+    return pd.Series(ratio)
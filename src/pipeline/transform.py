@@ -1,338 +1,446 @@
-from shapely.geometry import Point
+from datetime import date
 import pandas as pd
+import numpy as np
 import geopandas as gpd
-import networkx as nx
-import osmnx as ox
+import schedule
+import network
+import spatial
+import regions
+import session
+import runner
 import utils
-import json
+import os
 
 
-def berkeley_tracts():
+def schedule_path():
 
-    # Load Alameda tracts and Berkeley land boundary
-    alameda_tracts = gpd.read_file(utils.clean_dir("alameda_tracts.geojson"))
-    berkeley_boundary = gpd.read_file(
-        utils.clean_dir("berkeley_boundary.geojson")
+    # Weekday AC Transit schedule (a JSON file or a directory of per-route
+    # files): PIPELINE_SCHEDULE, else the latest ingested, else today's
+    return (
+        os.getenv("PIPELINE_SCHEDULE")
+        or utils.latest_raw("schedule")
+        or utils.raw_dir(f"schedule_{date.today().isoformat()}")
     )
 
+
+# Isochrone parameters
+walk_distance = 500  # meters
+walk_speed = 5  # kph
+
+
+# Hours in each time block
+time_block_duration = {
+    "Early AM (5–6:59)": 2,
+    "AM Peak (7–9:59)": 3,
+    "Midday (10–14:59)": 5,
+    "PM Peak (15–18:59)": 4,
+    "Evening (19–21:59)": 3,
+    "Late Night (22–0:59)": 3,
+    "Overnight (1–4:59)": 4,
+}
+
+
+# Map an hour to a time block
+def time_block(hour):
+    if 5 <= hour <= 6:
+        return "Early AM (5–6:59)"
+    elif 7 <= hour <= 9:
+        return "AM Peak (7–9:59)"
+    elif 10 <= hour <= 14:
+        return "Midday (10–14:59)"
+    elif 15 <= hour <= 18:
+        return "PM Peak (15–18:59)"
+    elif 19 <= hour <= 21:
+        return "Evening (19–21:59)"
+    elif hour >= 22 or hour == 0:
+        return "Late Night (22–0:59)"
+    else:
+        return "Overnight (1–4:59)"
+
+
+# Time block of each hour of the day, with categories in name order
+hour_time_block = pd.Categorical(
+    [time_block(hour) for hour in range(24)],
+    categories=sorted(time_block_duration)
+)
+
+
+@runner.task(
+    inputs=[
+        utils.clean_path("alameda_tracts"),
+        utils.clean_path("{region.name}_boundary")
+    ],
+    outputs=[utils.clean_path("{region.name}_tracts")]
+)
+def region_tracts(region=regions.berkeley):
+
+    # Load Alameda tracts and the region's land boundary
+    alameda_tracts = session.read("alameda_tracts")
+    boundary = session.read(f"{region.name}_boundary")
+
     # Create a representative point for each Alameda tract
     alameda_points = gpd.GeoDataFrame(
         geometry=alameda_tracts.representative_point()
     )
 
-    # Spatially filter representative points within Berkeley boundary
-    berkeley_points = gpd.sjoin(
+    # Spatially filter representative points within the region boundary
+    region_points = gpd.sjoin(
         alameda_points,
-        berkeley_boundary,
+        boundary,
         how="inner",
         predicate="intersects"
     )
 
     # Drop right index column to sjoin again
-    berkeley_points = berkeley_points.drop(columns=["index_right"])
+    region_points = region_points.drop(columns=["index_right"])
 
     # Map representative points back to polygons
-    berkeley_tracts = gpd.sjoin(
+    tracts = gpd.sjoin(
         alameda_tracts,
-        berkeley_points,
+        region_points,
         how="inner",
         predicate="intersects"
     )
 
     # Reset index
-    berkeley_tracts = berkeley_tracts.reset_index(drop=True)
+    tracts = tracts.reset_index(drop=True)
 
     # Select relevant columns
-    berkeley_tracts = berkeley_tracts[["tract", "geometry"]]
+    tracts = tracts[["tract", "geometry"]]
 
-    # Export Berkeley census tracts
-    utils.export_clean(berkeley_tracts, "berkeley_tracts.geojson")
+    # Export the region's census tracts
+    session.write(tracts, f"{region.name}_tracts")
 
 
-def berkeley_stops():
+@runner.task(
+    inputs=[
+        utils.clean_path("ac_stops"),
+        utils.clean_path("{region.name}_tracts")
+    ],
+    outputs=[utils.clean_path("{region.name}_stops")]
+)
+def region_stops(region=regions.berkeley):
 
-    # Load AC Transit stops and Berkeley tracts
-    ac_stops = gpd.read_file(utils.clean_dir("ac_stops.geojson"))
-    berkeley_tracts = gpd.read_file(utils.clean_dir("berkeley_tracts.geojson"))
+    # Load AC Transit stops and the region's tracts
+    ac_stops = session.read("ac_stops")
+    tracts = session.read(f"{region.name}_tracts")
 
-    # Spatially filter AC Transit stops in Berkeley
-    berkeley_stops = gpd.sjoin(
+    # Spatially filter AC Transit stops in the region
+    stops = gpd.sjoin(
         ac_stops,
-        berkeley_tracts,
+        tracts,
         how="inner",
         predicate="intersects"
     )
 
     # Drop right index column
-    berkeley_stops = berkeley_stops.drop(columns=["index_right"])
+    stops = stops.drop(columns=["index_right"])
 
     # Reset index
-    berkeley_stops = berkeley_stops.reset_index(drop=True)
+    stops = stops.reset_index(drop=True)
 
-    # Export berkeley bus stops
-    utils.export_clean(berkeley_stops, "berkeley_stops.geojson")
+    # Export the region's bus stops
+    session.write(stops, f"{region.name}_stops")
 
 
-def coverage():
+@runner.task(
+    outputs=[network.graph_cache_path("{batch}", "walk", walk_speed)]
+)
+def walk_network(batch=(regions.berkeley,)):
 
-    # Set isochrone parameters
-    distance = 500  # meters
-    speed = 5  # kph
-    time = distance / 1000 / speed * 60  # minutes
-
-    # Create Berkeley OSMnx graph
-    G = ox.graph.graph_from_place(
-        "Berkeley, California, USA", network_type="walk")
-
-    # Project graph and set edge attributes
-    G = ox.projection.project_graph(G)
-    nx.set_edge_attributes(G, speed, "speed_kph")
-    G = ox.routing.add_edge_travel_times(G)
-
-    # Load Berkeley stops
-    berkeley_stops = gpd.read_file(
-        utils.clean_dir("berkeley_stops.geojson")
+    # Download and cache one walk graph covering every region in the batch
+    network.walk_graph(
+        [region.place for region in batch],
+        name=regions.batch_name(batch),
+        network_type="walk",
+        speed=walk_speed
+    )
+
+
+def _walk_csr_graph(batch, graph_file=None):
+
+    # Load the batch's walk graph as CSR arrays (shared across regions)
+    if graph_file is not None:
+        return network.csr_graph(
+            network.walk_graph(filepath=graph_file, speed=walk_speed),
+            weight="time"
+        )
+
+    return network.load_csr_graph(
+        network.graph_cache_path(
+            regions.batch_name(batch), "walk", walk_speed),
+        weight="time"
     )
 
+
+def _snap_stops(graph, stops):
+
     # Project stops to meters
-    projected_stops = ox.projection.project_gdf(
-        berkeley_stops, to_crs=G.graph["crs"])["geometry"]
+    projected_stops = stops.to_crs(graph.crs)["geometry"]
 
     # Snap stops to nearest node on graph
-    nodes = ox.distance.nearest_nodes(
-        G,
-        X=projected_stops.x,
-        Y=projected_stops.y
+    return network.nearest_positions(
+        graph,
+        x=projected_stops.x,
+        y=projected_stops.y
     )
 
-    # Generate isochrones for each node
-    isochrones = []
-    for node in set(nodes):
 
-        # Create subgraph of reachable nodes
-        subgraph = nx.ego_graph(G, node, radius=time, distance='time')
-        reachable_nodes = [
-            Point(data['x'], data['y'])
-            for _, data
-            in subgraph.nodes(data=True)
-        ]
+@runner.task(
+    inputs=[
+        network.graph_cache_path("{batch}", "walk", walk_speed),
+        utils.clean_path("{region.name}_stops")
+    ],
+    outputs=[utils.clean_path("{region.name}_stop_isochrones")]
+)
+def stop_isochrones(
+    region=regions.berkeley,
+    batch=(regions.berkeley,),
+    workers=1,
+    graph_file=None
+):
 
-        # Create a polygon from all reachable nodes within the subgraph
-        if reachable_nodes:
-            polygon = gpd.GeoSeries(reachable_nodes).union_all().convex_hull
-            isochrones.append(polygon)
+    # Set isochrone parameters
+    time = walk_distance / 1000 / walk_speed * 60  # minutes
+
+    # Load the walk graph and the region's stops
+    graph = _walk_csr_graph(batch, graph_file)
+    stops = session.read(f"{region.name}_stops")
+
+    # Snap stops to graph nodes
+    sources = _snap_stops(graph, stops)
+
+    # Generate one isochrone per distinct node, in sorted node order
+    nodes, inverse = np.unique(sources, return_inverse=True)
+    isochrones = network.isochrones(
+        graph,
+        nodes,
+        radius=time,
+        workers=workers
+    )
 
-    # Turn list of isochrones into a geodataframe
-    isochrones = gpd.GeoDataFrame(geometry=isochrones, crs=G.graph["crs"])
+    # Map each stop to its node's isochrone
+    stop_isochrones = gpd.GeoDataFrame(
+        {
+            "stop_id": stops["stop_id"],
+            "source": nodes[inverse]
+        },
+        geometry=[isochrones[i] for i in inverse],
+        crs=graph.crs
+    )
 
     # Project CRS
-    isochrones = isochrones.to_crs(berkeley_stops.crs)
+    stop_isochrones = stop_isochrones.to_crs(stops.crs)
+
+    # Export per-stop isochrones
+    session.write(stop_isochrones, f"{region.name}_stop_isochrones")
+
+
+@runner.task(
+    inputs=[
+        network.graph_cache_path("{batch}", "walk", walk_speed),
+        utils.clean_path("{region.name}_stops"),
+        utils.clean_path("{region.name}_stop_isochrones"),
+        utils.clean_path("{region.name}_boundary")
+    ],
+    outputs=[utils.clean_path("{region.name}_coverage")],
+    when={
+        network.graph_cache_path("{batch}", "walk", walk_speed):
+            lambda args: args["engine"] == "multi_source",
+        utils.clean_path("{region.name}_stop_isochrones"):
+            lambda args: args["engine"] != "multi_source"
+    }
+)
+def coverage(
+    region=regions.berkeley,
+    batch=(regions.berkeley,),
+    engine="ego",
+    graph_file=None
+):
+
+    # Set isochrone parameters
+    time = walk_distance / 1000 / walk_speed * 60  # minutes
+
+    # Load the region's stops
+    stops = session.read(f"{region.name}_stops")
+
+    # Union of the cached per-stop isochrones, or one multi-source walk-shed
+    # (hulls of the nodes nearest each stop, so somewhat smaller)
+    if engine == "multi_source":
+        graph = _walk_csr_graph(batch, graph_file)
+        walkshed = network.walkshed(
+            graph, _snap_stops(graph, stops), radius=time)
+        isochrones = gpd.GeoDataFrame(
+            geometry=[walkshed] if walkshed is not None else [],
+            crs=graph.crs
+        ).to_crs(stops.crs)
+    else:
+        isochrones = session.read(f"{region.name}_stop_isochrones")
+        isochrones = isochrones.drop_duplicates(
+            "source").sort_values("source")
 
     # Merge isochrones into a single polygon
     coverage = gpd.GeoDataFrame(
-        geometry=[isochrones.union_all()], crs=berkeley_stops.crs)
+        geometry=[isochrones.union_all()], crs=stops.crs)
 
-    # Load Berkeley land boundary
-    berkeley_boundary = gpd.read_file(
-        utils.clean_dir("berkeley_boundary.geojson")
-    )
+    # Load the region's land boundary
+    boundary = session.read(f"{region.name}_boundary")
 
-    # Clip coverage polygon to the Berkeley land boundary
-    coverage = gpd.clip(coverage, berkeley_boundary)
+    # Clip coverage polygon to the region's land boundary
+    coverage = gpd.clip(coverage, boundary)
 
     # Export coverage polygon
-    utils.export_clean(coverage, "coverage.geojson")
+    session.write(coverage, f"{region.name}_coverage")
 
 
-def tract_population_covered():
+def iter_region_blocks(region, chunk_tracts=None):
 
-    # Load CA block population and Berkeley tracts
-    ca_block_population = gpd.read_file(
-        utils.clean_dir("ca_block_population.geojson")
-    )
-    berkeley_tracts = gpd.read_file(
-        utils.clean_dir("berkeley_tracts.geojson")
-    )
+    # Load the region's tracts, in code order so chunks stay contiguous
+    tracts = session.read(f"{region.name}_tracts")
+    tracts = sorted(tracts["tract"].unique())
 
-    # Convert datatypes
-    ca_block_population["tract"] = ca_block_population["tract"].astype(
-        "string")
-    berkeley_tracts["tract"] = berkeley_tracts["tract"].astype("string")
+    # Load the region's land boundary
+    boundary = session.read(f"{region.name}_boundary")
 
-    # Filter CA blocks by Berkeley tracts
-    berkeley_block_population = ca_block_population[
-        ca_block_population["tract"].isin(berkeley_tracts["tract"])
-    ]
+    # Read all tracts at once, or chunk_tracts at a time
+    size = chunk_tracts or max(len(tracts), 1)
+    population = 0
+    for i in range(0, len(tracts), size):
 
-    # Assert summed popualation equals official Census population in 2020
-    assert berkeley_block_population["population"].sum() == 124321
+        # Load only this chunk's Alameda blocks
+        block_population = session.read_rows(
+            "block_population", "tract", tracts[i:i + size])
+        population += block_population["population"].sum()
 
-    # Load coverage polygon and Berkeley land boundary
-    coverage = gpd.read_file(
-        utils.clean_dir("coverage.geojson")
-    )
-    berkeley_boundary = gpd.read_file(
-        utils.clean_dir("berkeley_boundary.geojson")
-    )
+        # Clip non-land blocks with boundary
+        block_population = gpd.clip(block_population, boundary)
 
-    # Clip non-land blocks with boundary
-    berkeley_block_population = gpd.clip(
-        berkeley_block_population, berkeley_boundary)
+        # Project CRS for area calculations
+        yield block_population.to_crs(epsg=3310)
+
+    # Assert summed popualation equals official Census population in 2020
+    if region.population is not None:
+        assert population == region.population
 
-    # Project CRS for area calculations
-    berkeley_block_population = berkeley_block_population.to_crs(epsg=3310)
-    coverage = coverage.to_crs(epsg=3310).geometry.iloc[0]
 
-    # Compute area per block
-    area_block = berkeley_block_population.geometry.area
+def load_region_blocks(region):
+    return pd.concat(iter_region_blocks(region))
 
-    # Intersect each block with coverage polygon
-    area_overlap = berkeley_block_population.geometry.intersection(
-        coverage).area
 
-    # Compute area coverage ratio
-    area_ratio = area_overlap / area_block
+def _tract_population_covered(blocks, coverage):
+
+    # Compute area coverage ratio, intersecting only boundary blocks
+    area_ratio = spatial.area_ratio(blocks.geometry, coverage)
+    area_ratio.index = blocks.index
 
     # Compute area-weighted estimate of population covered
-    berkeley_block_population["population_covered"] = berkeley_block_population["population"] * area_ratio
+    blocks = blocks.assign(
+        population_covered=blocks["population"] * area_ratio)
 
     # Aggregate to tract level population coverage
-    tract_population_covered = berkeley_block_population.groupby(
-        ["tract"])[["population", "population_covered"]].sum().reset_index()
+    tract_population_covered = blocks.groupby(
+        ["tract"], observed=True)[["population", "population_covered"]].sum().reset_index()
 
     # Select relevant columns
-    tract_population_covered = tract_population_covered[[
+    return tract_population_covered[[
         "tract", "population", "population_covered"]]
 
+
+@runner.task(
+    inputs=[
+        utils.clean_path("block_population"),
+        utils.clean_path("{region.name}_tracts"),
+        utils.clean_path("{region.name}_coverage"),
+        utils.clean_path("{region.name}_boundary")
+    ],
+    outputs=[utils.clean_dir("{region.name}_tract_population_covered.csv")]
+)
+def tract_population_covered(region=regions.berkeley, chunk_tracts=None):
+
+    # Load coverage polygon
+    coverage = session.read(f"{region.name}_coverage")
+    coverage = coverage.to_crs(epsg=3310).geometry.iloc[0]
+
+    # Area-weighted population covered per tract, one chunk of blocks at a time
+    partials = [
+        _tract_population_covered(blocks, coverage)
+        for blocks in iter_region_blocks(region, chunk_tracts)
+    ]
+
+    # Add up the partial sums per tract
+    tract_population_covered = pd.concat(partials).groupby(
+        ["tract"], observed=True)[["population", "population_covered"]].sum().reset_index()
+
     # Export population covered in per tract
-    tract_population_covered.to_csv(
-        utils.clean_dir("tract_population_covered.csv"),
-        index=False
+    session.write_csv(
+        tract_population_covered,
+        f"{region.name}_tract_population_covered.csv"
     )
 
 
-def scheduled_arrivals():
-
-    # Helper: Map an hour to a time block
-    def time_block(hour):
-        if 5 <= hour <= 6:
-            return "Early AM (5–6:59)"
-        elif 7 <= hour <= 9:
-            return "AM Peak (7–9:59)"
-        elif 10 <= hour <= 14:
-            return "Midday (10–14:59)"
-        elif 15 <= hour <= 18:
-            return "PM Peak (15–18:59)"
-        elif 19 <= hour <= 21:
-            return "Evening (19–21:59)"
-        elif hour >= 22 or hour == 0:
-            return "Late Night (22–0:59)"
-        else:
-            return "Overnight (1–4:59)"
-
-    time_block_duration = {
-        "Early AM (5–6:59)": 2,
-        "AM Peak (7–9:59)": 3,
-        "Midday (10–14:59)": 5,
-        "PM Peak (15–18:59)": 4,
-        "Evening (19–21:59)": 3,
-        "Late Night (22–0:59)": 3,
-        "Overnight (1–4:59)": 4,
-    }
+@runner.task(
+    inputs=[
+        utils.clean_path("{region.name}_stops"),
+        schedule_path,
+        utils.clean_path("{region.name}_tracts"),
+        utils.clean_dir("{region.name}_tract_population_covered.csv")
+    ],
+    outputs=[
+        utils.clean_dir("{region.name}_stop_hourly_arrivals.csv"),
+        utils.clean_dir("{region.name}_hourly_arrivals.csv"),
+        utils.clean_dir("{region.name}_time_block_arrivals.csv"),
+        utils.clean_path("{region.name}_tract_time_block_arrivals")
+    ]
+)
+def scheduled_arrivals(region=regions.berkeley):
 
-    # Helper: Count hourly scheduled arrivals for a given route and bus stop
-    def count_scheduled_arrivals(schedule, route, stop_id, hour):
-
-        # Filter a stop by its route (e.g. route=51b then [51B northbound, 51B southbound])
-        routes = [
-            x
-            for x in schedule["Routes"]
-            if x.get("RouteId") == route
-        ]
-
-        count = 0
-        for r in routes:
-
-            # Scheduled bus departures within the hour
-            trips = [
-                trip
-                for trip in r["Trips"]
-                if int(trip.get("StartTime")[:2]) == hour
-            ]
-
-            # Count the times a bus reaches that stop
-            for trip in trips:
-                arrivals = [
-                    arrival
-                    for arrival in trip["StopTimes"]
-                    if int(arrival.get("StopTime")[11:13]) == hour
-                    and arrival.get("StopId") == stop_id
-                ]
-                count += len(arrivals)
-
-        return count
-
-    # Load Berkeley stops and weekday bus schedule
-    berkeley_stops = gpd.read_file(
-        utils.clean_dir("berkeley_stops.geojson")
+    # Load the region's stops and weekday bus schedule
+    stops = session.read(f"{region.name}_stops")
+    index = schedule.load_schedule_index(
+        schedule_path()
     )
-    with open(utils.raw_dir("schedule_2026-01-03.json"), "r") as file:
-        data = json.load(file)
 
-    # Convert datatypes
-    berkeley_stops[["stop_id", "routes", "tract"]] = berkeley_stops[[
-        "stop_id", "routes", "tract"]].astype("string")
-
-    # Split routes delimited by " "
-    berkeley_stops["routes"] = berkeley_stops["routes"].str.split(" ")
-
-    # Compute of bus arrivals per stop in Berkeley
-    observations = []
-    for _, stop in berkeley_stops.iterrows():
-        stop_id = stop["stop_id"]
-        routes = stop["routes"]
-
-        for hour in range(24):
-            arrivals = sum([
-                count_scheduled_arrivals(
-                    data,
-                    route,
-                    stop_id,
-                    hour
-                )
-                for route in routes
-            ])
-
-            observations.append({
-                "stop_id": stop_id,
-                "hour": hour,
-                "arrivals": arrivals
-            })
-
-    # Convert observations to dataframe
-    arrivals = pd.DataFrame(observations)
-
-    # Merge on stop_id to get tracts
-    arrivals = arrivals.merge(berkeley_stops, on="stop_id")
+    # Compute of bus arrivals per stop in the region
+    arrivals = schedule.stop_hour_arrivals(index, stops)
+
+    # Export bus arrivals per stop and hour
+    session.write_csv(arrivals, f"{region.name}_stop_hourly_arrivals.csv")
+
+    # Rows come 24 per stop in stop order, so repeat each stop's tract
+    arrivals["tract"] = stops["tract"].repeat(24).reset_index(drop=True)
 
     # Sanity check i.e. there are 24 observations per bus stop
-    assert len(arrivals) / 24 == len(berkeley_stops)
+    assert len(arrivals) / 24 == len(stops)
 
     # Export bus arrivals by hour
-    arrivals.groupby(["hour"])["arrivals"].sum().reset_index().to_csv(
-        utils.clean_dir("hourly_arrivals.csv"),
-        index=False
+    session.write_csv(
+        arrivals.groupby(["hour"])["arrivals"].sum().reset_index(),
+        f"{region.name}_hourly_arrivals.csv"
     )
 
-    # Map hour to time block
-    arrivals["time_block"] = arrivals["hour"].apply(
-        time_block).astype("string")
+    # Map hour to time block through the lookup table
+    arrivals["time_block"] = hour_time_block[arrivals["hour"].to_numpy()]
 
-    temp = arrivals.copy()
+    # Sum arrivals by tract and time block in one pass
+    tract_time_block_arrivals = (
+        arrivals
+        .groupby(["tract", "time_block"], observed=True)["arrivals"]
+        .sum()
+        .reset_index()
+    )
 
-    # Export bus arrivals by time block
-    temp = temp.groupby(["time_block"])["arrivals"].sum().reset_index()
+    # Time block totals from the tract sums
+    temp = (
+        tract_time_block_arrivals
+        .groupby(["time_block"], observed=True)["arrivals"]
+        .sum()
+        .reset_index()
+    )
+    temp["time_block"] = temp["time_block"].astype("string")
+    tract_time_block_arrivals["time_block"] = tract_time_block_arrivals["time_block"].astype(
+        "string")
 
+    # Export bus arrivals by time block
     temp["time_block_duration"] = temp["time_block"].map(
         time_block_duration)
     temp["average_arrivals"] = temp["arrivals"] / \
@@ -340,39 +448,22 @@ def scheduled_arrivals():
     temp["average_arrivals"].drop(
         columns=["time_block_duration"])
 
-    temp.to_csv(
-        utils.clean_dir("time_block_arrivals.csv"),
-        index=False
-    )
+    session.write_csv(temp, f"{region.name}_time_block_arrivals.csv")
 
-    # Sum arrivals by tract and time block
-    arrivals["tract"] = arrivals["tract"].astype("string")
-    tract_time_block_arrivals = (
-        arrivals
-        .groupby(["tract", "time_block"])["arrivals"]
-        .sum()
-        .reset_index()
-    )
-
-    # Load Berkeley tracts
-    berkeley_tracts = gpd.read_file(
-        utils.clean_dir("berkeley_tracts.geojson")
-    )
-
-    # Convert datatype
-    berkeley_tracts["tract"] = berkeley_tracts["tract"].astype("string")
+    # Load the region's tracts
+    tracts = session.read(f"{region.name}_tracts")
 
     # Sanity check
     assert len(tract_time_block_arrivals) == len(
-        tract_time_block_arrivals["time_block"].unique()) * len(berkeley_tracts)
+        tract_time_block_arrivals["time_block"].unique()) * len(tracts)
 
     # Merge on tract to get geometry
-    tract_time_block_arrivals = berkeley_tracts.merge(
+    tract_time_block_arrivals = tracts.merge(
         tract_time_block_arrivals, on="tract")
 
     # Load the population covered per tract
-    tract_population_covered = pd.read_csv(
-        utils.clean_dir("tract_population_covered.csv")
+    tract_population_covered = session.read_csv(
+        f"{region.name}_tract_population_covered.csv"
     )
 
     tract_time_block_arrivals["time_block_duration"] = tract_time_block_arrivals["time_block"].map(
@@ -382,10 +473,6 @@ def scheduled_arrivals():
     tract_time_block_arrivals["average_arrivals"].drop(
         columns=["time_block_duration"])
 
-    # Convert datatype
-    tract_population_covered["tract"] = tract_population_covered["tract"].astype(
-        "string")
-
     # Merge on tract to get population and population covered
     tract_time_block_arrivals = tract_time_block_arrivals.merge(
         tract_population_covered, on="tract")
@@ -395,20 +482,126 @@ def scheduled_arrivals():
         tract_time_block_arrivals["population_covered"] * 1000
 
     # Export tract-level arrivals per 1,000 covered residents by time block
-    utils.export_clean(tract_time_block_arrivals,
-                       "tract_time_block_arrivals.geojson")
+    session.write(tract_time_block_arrivals,
+                       f"{region.name}_tract_time_block_arrivals")
+
+
+@runner.task(
+    inputs=[
+        utils.clean_path("block_population"),
+        utils.clean_path("{region.name}_tracts"),
+        utils.clean_path("{region.name}_boundary"),
+        network.graph_cache_path("{batch}", "walk", walk_speed),
+        utils.clean_path("{region.name}_stops"),
+        utils.clean_path("{region.name}_stop_isochrones"),
+        utils.clean_dir("{region.name}_stop_hourly_arrivals.csv")
+    ],
+    outputs=[
+        utils.clean_dir("{region.name}_tract_hourly_population_covered.csv"),
+        utils.clean_dir(
+            "{region.name}_tract_time_block_population_covered.csv")
+    ],
+    when={
+        network.graph_cache_path("{batch}", "walk", walk_speed):
+            lambda args: args["engine"] == "multi_source",
+        utils.clean_path("{region.name}_stops"):
+            lambda args: args["engine"] == "multi_source",
+        utils.clean_path("{region.name}_stop_isochrones"):
+            lambda args: args["engine"] != "multi_source"
+    }
+)
+def time_slice_coverage(
+    region=regions.berkeley,
+    batch=(regions.berkeley,),
+    engine="ego",
+    chunk_tracts=None,
+    graph_file=None
+):
+
+    # Snapped node per stop, and the slice coverage from a set of nodes:
+    # the union of their cached isochrones, or one multi-source walk-shed
+    if engine == "multi_source":
+        time = walk_distance / 1000 / walk_speed * 60  # minutes
+        graph = _walk_csr_graph(batch, graph_file)
+        stops = session.read(f"{region.name}_stops")
+        stop_sources = pd.Series(
+            _snap_stops(graph, stops), index=stops["stop_id"])
+
+        # Helper: Walk-shed of the nodes, projected like the blocks
+        def slice_coverage(sources):
+            walkshed = network.walkshed(graph, sources, radius=time)
+            return gpd.GeoSeries(
+                [walkshed] if walkshed is not None else [],
+                crs=graph.crs
+            ).to_crs(epsg=3310).union_all()
+    else:
+        isochrones = session.read(f"{region.name}_stop_isochrones")
+        isochrones = isochrones.to_crs(epsg=3310)
+        stop_sources = isochrones.set_index("stop_id")["source"]
+        polygons = isochrones.drop_duplicates("source").set_index("source").geometry
+
+        # Helper: Union of the nodes' isochrones
+        def slice_coverage(sources):
+            return polygons.loc[sources].union_all()
+
+    # Load stops with at least one arrival per hour
+    arrivals = session.read_csv(f"{region.name}_stop_hourly_arrivals.csv")
+    arrivals["time_block"] = hour_time_block[arrivals["hour"].to_numpy()]
+    arrivals = arrivals[arrivals["arrivals"] > 0]
+
+    # Coverage of the stops served in each slice
+    slices = {
+        "hour": range(24),
+        "time_block": sorted(time_block_duration)
+    }
+    coverages = {}
+    for column, values in slices.items():
+        for value in values:
+            stop_ids = arrivals.loc[arrivals[column] == value, "stop_id"]
+            sources = np.unique(
+                stop_sources[stop_sources.index.isin(stop_ids)])
+            coverages[column, value] = slice_coverage(sources)
+
+    # Population covered per tract and slice, one chunk of blocks at a time
+    # (blocks are already clipped to land, so coverage needs no clip)
+    partials = {column: [] for column in slices}
+    for blocks in iter_region_blocks(region, chunk_tracts):
+        for (column, value), coverage in coverages.items():
+            partials[column].append(
+                _tract_population_covered(blocks, coverage)
+                .assign(**{column: value})
+            )
+
+    # Helper: Rows ordered by slice, then tract
+    def slice_population_covered(column):
+        results = pd.concat(partials[column], ignore_index=True)
+        results = results.groupby([column, "tract"], sort=False, observed=True)[[
+            "population", "population_covered"]].sum().reset_index()
+        results["order"] = results[column].map(
+            {value: i for i, value in enumerate(slices[column])})
+        results = results.sort_values(["order", "tract"]).reset_index(drop=True)
+        return results[["tract", column, "population", "population_covered"]]
+
+    # Export population covered per tract and hour
+    session.write_csv(
+        slice_population_covered("hour"),
+        f"{region.name}_tract_hourly_population_covered.csv"
+    )
 
+    # Export population covered per tract and time block
+    session.write_csv(
+        slice_population_covered("time_block"),
+        f"{region.name}_tract_time_block_population_covered.csv"
+    )
 
-def tract_midday_arrivals():
+
+def tract_midday_arrivals(region=regions.berkeley):
 
     # Load bus arrivals per tract by time block
-    tract_time_block_arrivals = gpd.read_file(
-        utils.clean_dir("tract_time_block_arrivals.geojson")
-    )
+    tract_time_block_arrivals = session.read(
+        f"{region.name}_tract_time_block_arrivals")
 
     # Convert data types
-    tract_time_block_arrivals[["time_block", "tract"]] = tract_time_block_arrivals[["time_block", "tract"]].astype(
-        "string")
     tract_time_block_arrivals["arrivals_per_1000_covered"] = tract_time_block_arrivals["arrivals_per_1000_covered"].astype(
         "float")
 
@@ -452,16 +645,13 @@ def tract_midday_arrivals():
         "arrivals_per_1000_covered", ascending=False).reset_index(drop=True)
 
     # Load vehicle ownership data
-    vehicle_ownership = pd.read_csv(
-        utils.clean_dir("vehicle_ownership.csv")
-    )
+    vehicle_ownership = session.read_csv("vehicle_ownership.csv")
 
     # Convert data types
     vehicle_ownership["zero_vehicle_households"] = vehicle_ownership["zero_vehicle_households"].astype(
         "float")
     vehicle_ownership["households"] = vehicle_ownership["households"].astype(
         "int")
-    vehicle_ownership["tract"] = vehicle_ownership["tract"].astype("string")
 
     # Compute % zero vehicle households
     vehicle_ownership["%_no_vehicle_households"] = vehicle_ownership["zero_vehicle_households"] / \
@@ -487,16 +677,13 @@ def tract_midday_arrivals():
     print(bottom)
 
     # Load college population
-    college_population = pd.read_csv(
-        utils.clean_dir("college_population.csv")
-    )
+    college_population = session.read_csv("college_population.csv")
 
     # Convert data types
     college_population["undergrad_pop"] = college_population["undergrad_pop"].astype(
         "int")
     college_population["grad_pop"] = college_population["grad_pop"].astype(
         "int")
-    college_population["tract"] = college_population["tract"].astype("string")
 
     # Merge college population
     filtered = filtered.merge(
@@ -544,38 +731,41 @@ def tract_midday_arrivals():
         .map({False: "Bottom 25%", True: "Top 75%"})
     )
 
-    utils.export_clean(students.drop(columns=[
-                       "arrivals_covered_percentile", "no_vehicle_percentile"]), "midday_students.geojson")
+    session.write(students.drop(columns=[
+                       "arrivals_covered_percentile", "no_vehicle_percentile"]), "midday_students")
 
-    utils.export_clean(non_students, "midday_non_students.geojson")
+    session.write(non_students, "midday_non_students")
 
 
-def tract_peak_arrivals():
+@runner.task(
+    inputs=[
+        utils.clean_dir("vehicle_ownership.csv"),
+        utils.clean_path("{region.name}_tract_time_block_arrivals"),
+        utils.clean_path("{region.name}_tracts"),
+        utils.clean_dir("{region.name}_tract_population_covered.csv")
+    ],
+    outputs=[utils.clean_path("{region.name}_peak_time_block_arrivals")]
+)
+def tract_peak_arrivals(region=regions.berkeley):
 
     # Load vehicle ownership data
-    vehicle_ownership = pd.read_csv(
-        utils.clean_dir("vehicle_ownership.csv")
-    )
+    vehicle_ownership = session.read_csv("vehicle_ownership.csv")
 
     # Convert data types
     vehicle_ownership["zero_vehicle_households"] = vehicle_ownership["zero_vehicle_households"].astype(
         "float")
     vehicle_ownership["households"] = vehicle_ownership["households"].astype(
         "int")
-    vehicle_ownership["tract"] = vehicle_ownership["tract"].astype("string")
 
     # Compute % zero vehicle households
     vehicle_ownership["%_no_vehicle_households"] = vehicle_ownership["zero_vehicle_households"] / \
         vehicle_ownership["households"] * 100
 
     # Load tract_block_time arrivals
-    tract_time_block_arrivals = gpd.read_file(
-        utils.clean_dir("tract_time_block_arrivals.geojson")
-    )
+    tract_time_block_arrivals = session.read(
+        f"{region.name}_tract_time_block_arrivals")
 
     # Convert data types
-    tract_time_block_arrivals[["tract", "time_block"]] = tract_time_block_arrivals[[
-        "tract", "time_block"]].astype("string")
     tract_time_block_arrivals["average_arrivals"] = tract_time_block_arrivals["average_arrivals"].astype(
         "float")
 
@@ -585,32 +775,25 @@ def tract_peak_arrivals():
 
     # Groupby tract + time block and sum on the average_arrivals
     peak_time_block_arrivals = tract_time_block_arrivals.groupby(
-        ["tract", "time_block"])[["average_arrivals"]].sum().reset_index()
+        ["tract", "time_block"], observed=True)[["average_arrivals"]].sum().reset_index()
 
     # Merge zero vehicle households
     peak_time_block_arrivals = peak_time_block_arrivals.merge(
         vehicle_ownership, on="tract")
 
-    # Load berkeley tracts for geometry
-    berkeley_tracts = gpd.read_file(
-        utils.clean_dir("berkeley_tracts.geojson")
-    )
-
-    # Convert datatypes
-    berkeley_tracts["tract"] = berkeley_tracts["tract"].astype("string")
+    # Load the region's tracts for geometry
+    tracts = session.read(f"{region.name}_tracts")
 
     # Merge geometry
-    peak_time_block_arrivals = berkeley_tracts.merge(
+    peak_time_block_arrivals = tracts.merge(
         peak_time_block_arrivals, on="tract")
 
     # Load tract population
-    tract_population_covered = pd.read_csv(
-        utils.clean_dir("tract_population_covered.csv")
+    tract_population_covered = session.read_csv(
+        f"{region.name}_tract_population_covered.csv"
     )
 
     # Convert datatypes
-    tract_population_covered["tract"] = tract_population_covered["tract"].astype(
-        "string")
     tract_population_covered["population_covered"] = tract_population_covered["population_covered"].astype(
         "float")
 
@@ -623,18 +806,22 @@ def tract_peak_arrivals():
         peak_time_block_arrivals["population_covered"] * 1000
 
     # Export
-    utils.export_clean(peak_time_block_arrivals,
-                       "peak_time_block_arrivals.geojson")
-
-
-def main():
-    berkeley_tracts()
-    berkeley_stops()
-    coverage()
-    tract_population_covered()
-    scheduled_arrivals()
-    # tract_midday_arrivals()
-    tract_peak_arrivals()
+    session.write(peak_time_block_arrivals,
+                       f"{region.name}_peak_time_block_arrivals")
+
+
+def main(batch=(regions.berkeley,)):
+    walk_network(batch)
+    for region in batch:
+        region_tracts(region)
+        region_stops(region)
+        stop_isochrones(region, batch)
+        coverage(region, batch)
+        tract_population_covered(region)
+        scheduled_arrivals(region)
+        time_slice_coverage(region)
+        # tract_midday_arrivals(region)
+        tract_peak_arrivals(region)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
 import geopandas as gpd
+import hashlib
 import os
+import re
 
 
 def raw_dir(filename):
@@ -9,13 +11,124 @@ def raw_dir(filename):
 def clean_dir(filename):
     return os.path.join("../../data/clean", filename)
 
-def export_clean(gdf, filename):
+
+def cache_dir(filename):
+    return os.path.join("../../data/cache", filename)
+
+
+def runs_dir(filename):
+    return os.path.join("../../data/runs", filename)
+
+
+def latest_raw(prefix):
+
+    # Newest dated raw download, e.g. schedule_2026-01-03.json or schedule_2026-01-03/
+    pattern = re.compile(rf"{re.escape(prefix)}_\d{{4}}-\d{{2}}-\d{{2}}(\.json)?$")
+    names = sorted(
+        name for name in os.listdir(raw_dir(""))
+        if pattern.match(name)
+    ) if os.path.isdir(raw_dir("")) else []
+
+    return raw_dir(names[-1]) if names else None
+
+
+def file_hash(path):
+
+    # SHA-256 of a file's contents, read in chunks
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def path_hash(path):
+
+    # Files hash their contents, directories their sorted file listing
+    if not os.path.isdir(path):
+        return file_hash(path)
+
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            digest.update(os.path.relpath(filepath, path).encode())
+            digest.update(file_hash(filepath).encode())
+
+    return digest.hexdigest()
+
+
+# File extension per intermediate format
+formats = {
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "geojson": ".geojson",
+}
+
+# Intermediate format between stages (GeoParquet unless overridden)
+clean_format = os.getenv("PIPELINE_FORMAT", "parquet")
+
+# Rows per Parquet row group, small enough that filtered reads can skip
+# most of a sorted layer using the row group statistics
+parquet_row_group_size = 16384
+
+# Also write a GeoJSON copy of every export (e.g. for the notebooks)
+export_geojson = os.getenv("PIPELINE_EXPORT_GEOJSON", "") == "1"
+
+
+def clean_path(name, fmt=None):
+    return clean_dir(name + formats[fmt or clean_format])
+
+
+def export_clean(gdf, name, fmt=None):
 
     # Assert input is a geodataframe
     assert isinstance(gdf, gpd.GeoDataFrame)
 
-    gdf.to_file(
-        clean_dir(filename),
-        driver="GeoJSON",
-        index=False
-    )
+    fmt = fmt or clean_format
+    path = clean_path(name, fmt)
+
+    if fmt == "parquet":
+        gdf.to_parquet(path, index=False, row_group_size=parquet_row_group_size)
+    elif fmt == "feather":
+        gdf.to_feather(path, index=False)
+    else:
+        gdf.to_file(path, driver="GeoJSON", index=False)
+
+    # Opt-in GeoJSON export alongside the intermediate file
+    if export_geojson and fmt != "geojson":
+        export_clean(gdf, name, fmt="geojson")
+
+
+def read_clean(name, fmt=None, **kwargs):
+
+    fmt = fmt or clean_format
+    path = clean_path(name, fmt)
+
+    if fmt == "parquet":
+        gdf = gpd.read_parquet(path, **kwargs)
+    elif fmt == "feather":
+        gdf = gpd.read_feather(path, **kwargs)
+    else:
+        gdf = gpd.read_file(path, **kwargs)
+
+    return gdf
+
+
+def read_clean_rows(name, column, values, fmt=None):
+
+    # Read only the rows whose column is in values, filtering in the reader
+    fmt = fmt or clean_format
+    values = [str(value) for value in values]
+
+    if fmt == "parquet":
+        return read_clean(name, fmt, filters=[(column, "in", values)])
+    elif fmt == "geojson":
+        quoted = ", ".join("'" + value.replace("'", "''") + "'" for value in values)
+        return read_clean(name, fmt, where=f"{column} IN ({quoted})")
+
+    # Feather has no row filter, so read it whole and select
+    gdf = read_clean(name, fmt)
+    return gdf[gdf[column].astype("string").isin(values)]